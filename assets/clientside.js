@@ -0,0 +1,19 @@
+/*
+ * Clientside callbacks for dashboard.py, used when CLIENTSIDE_CALLBACKS is set.
+ * The figures are shipped once in a dcc.Store built by figure_cache.build_figure_store,
+ * keyed by the callback input values joined with '|'.
+ */
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    honey: {
+        update_figure: function() {
+            var store = arguments[arguments.length - 1];
+            var key = Array.prototype.slice.call(arguments, 0, -1).join('|');
+            var frame = store.frames[key];
+
+            if (frame === undefined) {
+                return {'data': [], 'layout': store.layout};
+            }
+            return {'data': frame.data, 'layout': Object.assign({}, store.layout, frame.layout)};
+        }
+    }
+});
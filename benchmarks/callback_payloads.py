@@ -0,0 +1,79 @@
+'''
+Payload size and response time of the dashboard callbacks, with and without the
+callback response layer (figure_cache.install_response_layer).
+
+Every map, line plot and bubble chart input is requested twice through the
+Flask test client with gzip accepted, once cold and once repeated. The report
+shows the mean JSON bytes, the mean bytes on the wire after compression and
+the mean time until the response is available.
+
+usage:
+    python benchmarks/callback_payloads.py
+'''
+import gzip
+import json
+import os
+import subprocess
+import sys
+import time
+from os.path import abspath, dirname
+
+ROOT = dirname(dirname(abspath(__file__)))
+
+
+def callback_requests(dashboard):
+    data = dashboard.load_data()
+    for i in dashboard.map_stressors:
+        for j in data['slider_markers']:
+            yield ('update_map', 'us-map.figure',
+                   [{'id': 'dropdown1', 'property': 'value', 'value': i},
+                    {'id': 'slider1', 'property': 'value', 'value': j}])
+    for i in dashboard.state_names:
+        if i in set(data['colony_data'].state):
+            yield ('update_line_plot', 'state-line-plot.figure',
+                   [{'id': 'dropdown2', 'property': 'value', 'value': i}])
+    for i in range(2000, 2019):
+        yield ('update_bubble_plot', 'bubble-plot.figure',
+               [{'id': 'slider2', 'property': 'value', 'value': i}])
+
+
+def run():
+    sys.path.insert(0, ROOT)
+    os.chdir(ROOT)
+    import dashboard
+
+    client = dashboard.server.test_client()
+    results = {}
+    for (name, output, inputs) in callback_requests(dashboard):
+        body = {'output': output, 'outputs': {'id': output.split('.')[0], 'property': output.split('.')[1]},
+                'inputs': inputs, 'changedPropIds': [inputs[0]['id'] + '.' + inputs[0]['property']]}
+        for attempt in ['cold', 'repeat']:
+            start = time.perf_counter()
+            response = client.post('/_dash-update-component', json = body, headers = {'Accept-Encoding': 'gzip'})
+            elapsed = time.perf_counter() - start
+            wire = response.get_data()
+            raw = response.get_data() if response.content_encoding is None else gzip.decompress(wire)
+            results.setdefault((name, attempt), []).append((len(raw), len(wire), elapsed))
+
+    print(json.dumps([[name, attempt, rows] for ((name, attempt), rows) in results.items()]))
+
+
+def main():
+    print('{:<20}{:<8}{:<8}{:>12}{:>12}{:>10}'.format('callback', 'layer', 'call', 'json bytes', 'wire bytes', 'ms'))
+    for (label, setting) in [('off', '0'), ('on', '1')]:
+        env = dict(os.environ, CALLBACK_RESPONSE_CACHE = setting)
+        output = subprocess.run([sys.executable, abspath(__file__), '--run'], env = env,
+                                stdout = subprocess.PIPE, check = True).stdout
+        for (name, attempt, rows) in json.loads(output.decode().strip().split('\n')[-1]):
+            count = len(rows)
+            print('{:<20}{:<8}{:<8}{:>12.0f}{:>12.0f}{:>10.2f}'.format(
+                name, label, attempt,
+                sum(i[0] for i in rows) / count, sum(i[1] for i in rows) / count,
+                sum(i[2] for i in rows) / count * 1000))
+
+
+if __name__ == '__main__':
+    if '--run' in sys.argv:
+        run()
+    else:
+        main()
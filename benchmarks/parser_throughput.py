@@ -0,0 +1,69 @@
+'''
+Throughput of clean_colony_data and clean_production_data on synthetic releases of
+growing size (see synthetic_usda.py).
+
+For each size the report shows the number of 'd' rows in the file, the best time
+of the repeats, the rows parsed per second and the peak memory allocated by Python
+while cleaning the file once (tracemalloc). A throughput that drops as the files
+grow points at work that grows faster than the input.
+
+usage:
+    python benchmarks/parser_throughput.py [repeats] [counties] [max_blocks]
+'''
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from os.path import abspath, dirname, join
+
+ROOT = dirname(dirname(abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from synthetic_usda import write_colony_release, write_production_release
+
+from clean_honey_data import USDA_ENCODING, clean_colony_data, clean_production_data
+
+
+def count_data_rows(file_):
+    with open(file_, encoding = USDA_ENCODING) as f:
+        return sum(1 for i in f if ',"d",' in i)
+
+
+def measure(clean_function, file_, repeats):
+    best = None
+    for i in range(repeats):
+        start = time.perf_counter()
+        clean_function(file_)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    tracemalloc.start()
+    clean_function(file_)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return (best, peak)
+
+
+def main(repeats = 3, counties = 0, max_blocks = 256):
+    work_dir = tempfile.mkdtemp(prefix = 'honey_synthetic_')
+    sizes = [i for i in [1, 4, 16, 64, 256, 1024] if i <= max_blocks]
+    cases = [('clean_colony_data', 'quarters', write_colony_release, clean_colony_data),
+             ('clean_production_data', 'years', write_production_release, clean_production_data)]
+
+    print('{:<24}{:>8}{:>10}{:>11}{:>11}{:>13}{:>11}'.format('function', 'blocks', 'counties', 'rows', 'ms',
+                                                             'rows/s', 'peak KiB'))
+    for (name, unit, write_release, clean_function) in cases:
+        for blocks in sizes:
+            file_ = join(work_dir, '{}_{}.csv'.format(unit, blocks))
+            write_release(file_, blocks, counties)
+            rows = count_data_rows(file_)
+            (seconds, peak) = measure(clean_function, file_, repeats)
+            print('{:<24}{:>8}{:>10}{:>11}{:>11.1f}{:>13.0f}{:>11.0f}'.format(name, blocks, counties, rows, seconds * 1000,
+                                                                             rows / seconds, peak / 1024))
+
+    shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    main(*[int(i) for i in sys.argv[1:4]])
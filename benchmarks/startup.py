@@ -0,0 +1,68 @@
+'''
+Import time of the serving path, measured with python -X importtime.
+
+dashboard.py is imported in a fresh interpreter a few times and the report shows
+the best cumulative import time of dashboard and of its slowest imports. The
+benchmark fails (exit status 1) when the import takes longer than max_ms, or
+when it pulls in a module that only the offline pipeline needs, such as seaborn,
+matplotlib or xlrd, or when importing it loads the data.
+
+usage:
+    python benchmarks/startup.py [repeats] [max_ms]
+'''
+import re
+import subprocess
+import sys
+from os.path import abspath, dirname
+
+ROOT = dirname(dirname(abspath(__file__)))
+OFFLINE_MODULES = ['seaborn', 'matplotlib', 'xlrd']
+IMPORT_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+
+def import_times(module):
+    '''
+    Imports module in a fresh interpreter and returns a dictionary mapping every
+    top level or nested module imported to its cumulative import time in microseconds.
+    '''
+    code = 'import {0}, sys; print(bool(getattr({0}, "dashboard_data", None)))'.format(module)
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd = ROOT,
+                            stdout = subprocess.PIPE, stderr = subprocess.PIPE, check = True)
+    times = {}
+    for line in result.stderr.decode().splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            times[match.group(4)] = int(match.group(2))
+    times['data loaded'] = result.stdout.decode().strip() == 'True'
+    return times
+
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    max_ms = float(sys.argv[2]) if len(sys.argv) > 2 else 2000
+
+    runs = [import_times('dashboard') for i in range(repeats)]
+    best = min(runs, key = lambda times: times['dashboard'])
+    data_loaded = best.pop('data loaded')
+
+    print('{:<40}{:>12}'.format('module', 'cumulative ms'))
+    for (name, value) in sorted(best.items(), key = lambda item: -item[1])[:15]:
+        print('{:<40}{:>12.1f}'.format(name, value / 1000))
+
+    failures = []
+    total_ms = best['dashboard'] / 1000
+    if total_ms > max_ms:
+        failures.append('importing dashboard took {:.0f} ms, more than {:.0f} ms'.format(total_ms, max_ms))
+    for name in OFFLINE_MODULES:
+        if name in best:
+            failures.append('importing dashboard imports {}'.format(name))
+    if data_loaded:
+        failures.append('importing dashboard loads the data')
+
+    for failure in failures:
+        print('FAIL: ' + failure)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
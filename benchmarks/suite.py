@@ -0,0 +1,224 @@
+'''
+Benchmark suite for the cleaning pipeline, the figure generators and the Dash callbacks.
+
+Every benchmark is run against a copy of the committed USDA releases in which each
+state row is repeated scale times under a new name (Ex: 'Alabama 2'), and the
+releases are repeated period_scale times, every repetition shifted after the
+previous one in time (Ex: hony_all_2000-2001.csv is also written as
+hony_all_2018-2019.csv), so the same inputs can be timed on a dataset with scale
+times the states and about period_scale times the periods and years:
+
+- clean_colony_data and clean_production_data on every release file
+- get_data end to end
+- generate_map_object, generate_line_plot and generate_bubble_chart for every
+  stressor and period, state and year, the copies included
+- the map, line plot and bubble chart callbacks for the same inputs, through the
+  Flask test client, once with empty figure caches (cold) and once repeated (warm)
+
+For each benchmark the report shows the number of inputs, the mean and max time
+per input (best of the repeats), the peak memory allocated by Python while running
+every input once (tracemalloc) and the mean size of the output: the dataframe
+memory for the cleaning functions, the figure JSON for the generators and the
+response body for the callbacks. The callback response layer and the figure
+prefetching are turned off so every request reaches its callback and the cold
+requests find no prefetched figures.
+
+usage:
+    python benchmarks/suite.py [repeats] [scale] [period_scale]
+'''
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from os.path import abspath, basename, dirname, join
+
+ROOT = dirname(dirname(abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ['CALLBACK_RESPONSE_CACHE'] = '0'
+os.environ['PREFETCH_WORKERS'] = '0'
+
+import pandas as pd
+
+from clean_honey_data import (COLONY_PATH, PRODUCTION_PATH, USDA_ENCODING, clean_colony_data,
+                              clean_production_data, generate_bubble_chart, generate_line_plot,
+                              generate_map_object, get_data, get_release_year, get_source_files, index_by,
+                              read_usda_rows)
+
+MAP_STRESSORS = ["varroa_mites", "pesticides", "other_pests", "unknown", "diseases", "other"]
+LINE_STRESSORS = ["varroa_mites", "other_pests", "pesticides", "diseases", "lost_perc"]
+
+
+def scale_release(file_, output_file, scale):
+    '''
+    Writes a copy of a USDA release with every state data row followed by scale - 1
+    copies of itself under new state names. Wyoming rows are not copied since they
+    close the table blocks.
+    '''
+    with open(output_file, 'w', encoding = USDA_ENCODING) as f:
+        for row in read_usda_rows(file_):
+            rows = [row]
+            if len(row) > 2 and row[1] == 'd' and row[2] not in ('', 'Wyoming', 'WY'):
+                rows += [row[:2] + [row[2] + ' ' + str(i)] + row[3:] for i in range(2, scale + 1)]
+            for i in rows:
+                f.write(','.join('"' + j + '"' for j in i) + '\n')
+
+
+def shift_release_name(name, years):
+    '''
+    Returns the file name of a release moved years later.
+    Ex: shift_release_name('hony_all_2000-2001.csv', 18) returns 'hony_all_2018-2019.csv'
+    '''
+    return re.sub(r'(\d{4})-(\d{4})', lambda i: '{}-{}'.format(int(i.group(1)) + years, int(i.group(2)) + years),
+                  name, count = 1)
+
+
+def scale_releases(path_, output_path, scale, period_scale = 1):
+    '''
+    Writes the releases of a data directory scaled by scale_release, period_scale
+    times, every repetition moved past the years covered by the previous one.
+    '''
+    os.makedirs(output_path)
+    releases = get_source_files(path_)
+    years = [get_release_year(i) for i in releases]
+    span = max(years) - min(years) + 1
+    files = []
+    for i in range(period_scale):
+        for j in releases:
+            files.append(join(output_path, shift_release_name(basename(j), i * span)))
+            scale_release(j, files[-1], scale)
+    return files
+
+
+def measure(name, calls, repeats, size):
+    '''
+    Times a list of (input, function) pairs and returns a row of the report.
+
+    input parameters:
+        name: Name of the benchmark
+        calls: List of (input label, function with no arguments) pairs
+        repeats: Number of times each function is timed, the best time is kept
+        size: A function returning the output size in bytes of a function's result
+    '''
+    times = []
+    sizes = []
+    for (label, call) in calls:
+        best = None
+        for i in range(repeats):
+            start = time.perf_counter()
+            result = call()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        times.append(best)
+        sizes.append(size(result))
+
+    tracemalloc.start()
+    for (label, call) in calls:
+        call()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return (name, len(calls), sum(times) / len(times), max(times), peak, sum(sizes) / len(sizes))
+
+
+def frame_bytes(result):
+    frames = result if isinstance(result, tuple) else (result,)
+    return sum(int(i.memory_usage(deep = True).sum()) for i in frames)
+
+
+def figure_bytes(result):
+    return len(result.to_json())
+
+
+def callback_requests(dashboard, states):
+    '''
+    Yields the (output, inputs) of every callback request: every stressor and
+    period of the map, every state of the line plot and every year of the bubble chart.
+    '''
+    data = dashboard.load_data()
+    for i in MAP_STRESSORS:
+        for j in data['slider_markers']:
+            yield ('us-map.figure', [{'id': 'dropdown1', 'property': 'value', 'value': i},
+                                     {'id': 'slider1', 'property': 'value', 'value': j}])
+    for i in states:
+        yield ('state-line-plot.figure', [{'id': 'dropdown2', 'property': 'value', 'value': i}])
+    for i in data['bubble_years']:
+        yield ('bubble-plot.figure', [{'id': 'slider2', 'property': 'value', 'value': i}])
+
+
+def callback_calls(dashboard, states, clear_caches):
+    client = dashboard.server.test_client()
+    calls = []
+    for (output, inputs) in callback_requests(dashboard, states):
+        body = {'output': output, 'outputs': {'id': output.split('.')[0], 'property': output.split('.')[1]},
+                'inputs': inputs, 'changedPropIds': [inputs[0]['id'] + '.' + inputs[0]['property']]}
+
+        def call(body = body):
+            if clear_caches:
+                dashboard.map_figure_cache.clear()
+                dashboard.line_figure_cache.clear()
+                dashboard.bubble_figure_cache.clear()
+            return client.post('/_dash-update-component', json = body)
+        calls.append((output, call))
+    return calls
+
+
+def main(repeats = 3, scale = 1, period_scale = None):
+    period_scale = scale if period_scale is None else period_scale
+    work_dir = tempfile.mkdtemp(prefix = 'honey_benchmark_')
+    colony_files = scale_releases(COLONY_PATH, join(work_dir, 'colony_data'), scale, period_scale)
+    production_files = scale_releases(PRODUCTION_PATH, join(work_dir, 'production_data'), scale, period_scale)
+
+    #the datasets the figures and callbacks run on, written where the dashboard loads them
+    honey_prod, colony_data = get_data(colony_path = join(work_dir, 'colony_data'),
+                                       production_path = join(work_dir, 'production_data'))
+    honey_prod.to_csv(join(work_dir, 'all_honey_data.csv'), index = False)
+    colony_data.to_csv(join(work_dir, 'all_colony_data.csv'), index = False)
+    honey_data = pd.read_csv(join(work_dir, 'all_honey_data.csv'))
+    colony_data = pd.read_csv(join(work_dir, 'all_colony_data.csv'))
+
+    colony_by_period = index_by(colony_data, 'period')
+    colony_by_state = index_by(colony_data, 'state')
+    honey_by_year = index_by(honey_data, 'year')
+    periods = list(colony_by_period)
+    #the copies cannot be picked in the state dropdown, but the line plot callback serves them
+    states = list(colony_by_state)
+    years = list(honey_by_year)
+
+    import dashboard
+    dashboard.DATA_DIR = work_dir
+
+    rows = [
+        measure('clean_colony_data', [(i, lambda i = i: clean_colony_data(i)) for i in colony_files],
+                repeats, frame_bytes),
+        measure('clean_production_data', [(i, lambda i = i: clean_production_data(i)) for i in production_files],
+                repeats, frame_bytes),
+        measure('get_data', [('all', lambda: get_data(colony_path = join(work_dir, 'colony_data'),
+                                                      production_path = join(work_dir, 'production_data')))],
+                repeats, frame_bytes),
+        measure('generate_map_object', [((i, j), lambda i = i, j = j: generate_map_object(colony_by_period, j, i))
+                                        for i in MAP_STRESSORS for j in periods], repeats, figure_bytes),
+        measure('generate_line_plot', [(i, lambda i = i: generate_line_plot(colony_by_state, LINE_STRESSORS, i))
+                                       for i in states], repeats, figure_bytes),
+        measure('generate_bubble_chart', [(i, lambda i = i: generate_bubble_chart(honey_by_year, i, 15))
+                                          for i in years], repeats, figure_bytes),
+        measure('callbacks (cold)', callback_calls(dashboard, states, True), repeats,
+                lambda response: len(response.get_data())),
+        measure('callbacks (warm)', callback_calls(dashboard, states, False), repeats,
+                lambda response: len(response.get_data())),
+    ]
+
+    print('scale {}, period scale {}: {} states, {} periods, {} years, {} colony rows, {} honey rows'.format(
+        scale, period_scale, len(states), len(periods), len(years), len(colony_data), len(honey_data)))
+    print('{:<24}{:>8}{:>11}{:>11}{:>12}{:>15}'.format('benchmark', 'inputs', 'mean ms', 'max ms', 'peak KiB', 'output bytes'))
+    for (name, count, mean, max_, peak, size) in rows:
+        print('{:<24}{:>8}{:>11.2f}{:>11.2f}{:>12.0f}{:>15.0f}'.format(name, count, mean * 1000, max_ * 1000,
+                                                                        peak / 1024, size))
+
+    shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    main(*[int(i) for i in sys.argv[1:4]])
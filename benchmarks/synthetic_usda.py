@@ -0,0 +1,122 @@
+'''
+Generator of synthetic USDA release files, laid out like the files in colony_data
+and production_data, for scale testing the cleaning functions.
+
+Every table is written as 't' title rows, 'h' header rows, a 'u' units row and
+'d' data rows running from Alabama to Wyoming, with a blank 'd' row after every
+ten states and the Other States and United States rows after Wyoming. The size of
+a file is set by the number of table blocks (quarters for the colony releases,
+years for the production releases) and by the number of county rows written
+after each state row. Values are random, with some suppressed ('-', '(X)') or
+rounded to zero ('(Z)') like in the releases.
+
+usage:
+    python benchmarks/synthetic_usda.py output_dir [quarters] [years] [counties]
+'''
+import os
+import random
+import sys
+from os.path import abspath, dirname, join
+
+ROOT = dirname(dirname(abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from clean_honey_data import USDA_ENCODING, get_state_names
+
+#Alabama to Wyoming, the range of a table block
+STATES = get_state_names()
+SUPPRESSED = ['-', '(X)', '(Z)']
+
+
+def quote(value):
+    return value if isinstance(value, (int, float)) else '"' + value + '"'
+
+
+def write_row(f, table_no, row_type, values):
+    f.write(','.join(str(quote(i)) for i in [table_no, row_type] + values) + '\n')
+
+
+def random_value(rng, low, high, decimals = 0):
+    if rng.random() < 0.03:
+        return rng.choice(SUPPRESSED)
+    value = rng.uniform(low, high)
+    return round(value, decimals) if decimals else int(value)
+
+
+def write_table(f, rng, table_no, title, units, value_ranges, counties):
+    '''
+    Writes one table block. value_ranges holds a (low, high, decimals) tuple per
+    data column.
+    '''
+    width = len(value_ranges)
+    write_row(f, table_no, 't', [title])
+    write_row(f, table_no, 'h', [''] * (width + 1))
+    write_row(f, table_no, 'h', ['State'] + ['column ' + str(i + 1) for i in range(width)])
+    write_row(f, table_no, 'u', [''] + [units] * width)
+
+    for (i, state) in enumerate(STATES):
+        write_row(f, table_no, 'd', [state] + [random_value(rng, *j) for j in value_ranges])
+        if state != 'Wyoming':
+            for k in range(counties):
+                write_row(f, table_no, 'd', [state + ' County ' + str(k + 1)] +
+                          [random_value(rng, *j) for j in value_ranges])
+        if i % 10 == 9:
+            write_row(f, table_no, 'd', [''] * (width + 1))
+
+    write_row(f, table_no, 'd', [''] * (width + 1))
+    write_row(f, table_no, 'd', ['Other States 5/'] + [random_value(rng, *j) for j in value_ranges])
+    write_row(f, table_no, 'd', [''] * (width + 1))
+    write_row(f, table_no, 'd', ['United States'] + [random_value(rng, *j) for j in value_ranges])
+
+
+def write_colony_release(file_, quarters = 4, counties = 0, seed = 0):
+    '''
+    Writes a synthetic colony release with one colony count table and one stressor
+    table per quarter.
+
+    input parameters:
+        file_: path of the file to write
+        quarters: number of quarters, the table blocks of each kind
+        counties: number of county rows written after each state row
+        seed: seed of the random values
+    '''
+    rng = random.Random(seed)
+    colony_ranges = [(1000, 300000, 0)] * 3 + [(0, 60, 0)] + [(100, 100000, 0)] * 2 + [(0, 60, 0)]
+    disease_ranges = [(0, 80, 1)] * 6
+
+    with open(file_, 'w', encoding = USDA_ENCODING) as f:
+        for i in range(quarters):
+            write_table(f, rng, i + 1, 'Colonies, Lost, Added and Renovated: Quarter ' + str(i + 1),
+                        '(number)', colony_ranges, counties)
+        for i in range(quarters):
+            write_table(f, rng, quarters + i + 1, 'Percent of colonies affected by stressors: Quarter ' + str(i + 1),
+                        '(percent)', disease_ranges, counties)
+
+
+def write_production_release(file_, years = 2, counties = 0, seed = 0):
+    '''
+    Writes a synthetic honey production release with one production table per year.
+
+    input parameters:
+        file_: path of the file to write
+        years: number of years, the table blocks
+        counties: number of county rows written after each state row
+        seed: seed of the random values
+    '''
+    rng = random.Random(seed)
+    production_ranges = [(1, 500, 0), (20, 120, 0), (10, 40000, 0), (1, 5000, 0), (100, 900, 0), (100, 70000, 0)]
+
+    with open(file_, 'w', encoding = USDA_ENCODING) as f:
+        for i in range(years):
+            write_table(f, rng, i + 1, 'Number of Colonies, Yield, Production, Stocks, Price, and Value: Year ' + str(i + 1),
+                        '(1,000)', production_ranges, counties)
+
+
+def main(output_dir, quarters = 4, years = 2, counties = 0):
+    os.makedirs(output_dir, exist_ok = True)
+    write_colony_release(join(output_dir, 'hcny_all_tables_synthetic.csv'), int(quarters), int(counties))
+    write_production_release(join(output_dir, 'hony_all_tables_synthetic.csv'), int(years), int(counties))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:5])
@@ -0,0 +1,78 @@
+'''
+Benchmark of the typing stage of the cleaning functions.
+
+Times the column by column coercion and list comprehension state mapping that
+clean_production_data used to do against the vectorized set_column_types and
+map_state_columns, on the raw data rows of every file in production_data. A scale factor repeats
+the rows of each file to show how both versions grow with the input size.
+
+usage:
+    python benchmarks/typing_stage.py [repeats] [scale]
+'''
+import sys
+import timeit
+from os import listdir
+from os.path import abspath, dirname, join
+
+import pandas as pd
+
+ROOT = dirname(dirname(abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from clean_honey_data import (abbrev_us_state, us_state_abbrev, read_usda_rows,
+                              set_column_types, map_state_columns)
+
+PRODUCTION_COLUMNS = ["state", "honey_colonies", "yield_per_col", "production", 'stocks',
+                      'avg_price_per_lb', 'prod_value', 'quarter']
+
+
+def raw_production_frame(file_):
+    rows = [i[2:] + ['Q1'] for i in read_usda_rows(file_) if len(i) == 9 and i[1] == 'd']
+    return pd.DataFrame(rows, columns = PRODUCTION_COLUMNS)
+
+
+def legacy_typing(prod_df):
+    prod_df = prod_df.copy()
+    prod_df.replace(['(X)', '-'], "", inplace = True)
+    prod_df.replace(['(Z)'], "0", inplace = True)
+
+    categoricals = ['state', 'quarter']
+    for (columnName, columnData) in prod_df.items():
+        if(columnName not in categoricals):
+            prod_df[columnName] = pd.to_numeric(prod_df[columnName], errors = 'coerce', downcast = 'float')
+        else:
+            prod_df[columnName] = prod_df[columnName].astype(str)
+
+    prod_df = prod_df[prod_df.state != ""].copy()
+    prod_df['state'] = [abbrev_us_state[i] if i in list(abbrev_us_state.keys()) else i for i in prod_df.state]
+    prod_df['state_code'] = [us_state_abbrev[i] if i in list(us_state_abbrev.keys()) else i for i in prod_df.state]
+    return prod_df
+
+
+def vectorized_typing(prod_df):
+    prod_df = set_column_types(prod_df)
+    prod_df = prod_df[prod_df.state != ""]
+    return map_state_columns(prod_df)
+
+
+def main(repeats = 20, scale = 1):
+    production_path = join(ROOT, 'production_data')
+    files = sorted(listdir(production_path))
+
+    print('{:<34}{:>7}{:>13}{:>13}{:>9}'.format('file', 'rows', 'legacy ms', 'vector ms', 'speedup'))
+    total_legacy = total_vector = 0
+    for i in files:
+        raw = raw_production_frame(join(production_path, i))
+        raw = pd.concat([raw] * scale, ignore_index = True)
+        legacy = min(timeit.repeat(lambda: legacy_typing(raw), number = 1, repeat = repeats))
+        vector = min(timeit.repeat(lambda: vectorized_typing(raw), number = 1, repeat = repeats))
+        total_legacy += legacy
+        total_vector += vector
+        print('{:<34}{:>7}{:>13.2f}{:>13.2f}{:>8.1f}x'.format(i, len(raw), legacy * 1000, vector * 1000, legacy / vector))
+
+    print('{:<34}{:>7}{:>13.2f}{:>13.2f}{:>8.1f}x'.format('total', '', total_legacy * 1000, total_vector * 1000,
+                                                          total_legacy / total_vector))
+
+
+if __name__ == '__main__':
+    main(*[int(i) for i in sys.argv[1:3]])
@@ -0,0 +1,222 @@
+import os
+import time
+import cProfile
+import threading
+from functools import wraps
+from os.path import join
+
+import flask
+
+#Upper bounds of the callback latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class CallbackMetrics:
+    '''
+    Thread safe per callback counters of the Dash callback requests, rendered in the
+    Prometheus text format by install_metrics. The counters are kept per process, so
+    with several gunicorn workers each worker reports its own requests.
+
+    For every callback it records the number of requests and cache hits, a histogram
+    of the request time, the response bytes and a split of the request time:
+    
+    - figure: building the plotly figures, as timed by the FigureCache (the whole
+      callback function for a callback that does not use one)
+    - serialization: serializing the figures when they are cached and parsing them
+      back when they are served, as timed by the FigureCache
+    - other: the rest of the request, mostly the request hooks, the data version
+      check and the encoding of the response by Dash
+
+    input parameters:
+        profile_dir: When given, every callback request is run under cProfile and its
+                     stats are dumped in this directory as <callback>-<time>.prof
+        buckets: Upper bounds of the latency histogram buckets, in seconds
+    '''
+
+    def __init__(self, profile_dir = None, buckets = LATENCY_BUCKETS):
+        self.profile_dir = profile_dir
+        self.buckets = buckets
+        self._callbacks = {}
+        self._outputs = {}
+        self._caches = {}
+        self._prefetchers = {}
+        self._lock = threading.Lock()
+
+    def instrument(self, function):
+        '''
+        Wraps a callback function so its name and the time it takes are recorded for
+        the current request. Apply it before registering the callback.
+        '''
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            result = function(*args, **kwargs)
+            flask.g.callback_function_seconds = time.perf_counter() - start
+            flask.g.callback_name = function.__name__
+            return result
+        return wrapper
+
+    def add_cache(self, name, cache):
+        '''
+        Adds a FigureCache or ResponseCache whose hits, misses and size are reported
+        under name.
+        '''
+        self._caches[name] = cache
+
+    def add_prefetcher(self, name, prefetcher):
+        '''
+        Adds a FigurePrefetcher whose counters are reported under name. How often
+        prefetching pays off is reported by the caches it fills, as prefetch hits.
+        '''
+        self._prefetchers[name] = prefetcher
+
+    def record(self, output, name, seconds, figure_seconds, serialization_seconds, response_bytes, cache_hit):
+        '''
+        Records one callback request. Cache hits never reach the callback function,
+        so when name is None the request is named after the callback last seen
+        producing the same output, or after the output itself.
+
+        returns:
+            name: The name the request was recorded under
+        '''
+        with self._lock:
+            if name is not None:
+                self._outputs[output] = name
+            else:
+                name = self._outputs.get(output, output)
+
+            callback = self._callbacks.get(name)
+            if callback is None:
+                callback = {'requests': 0, 'cache_hits': 0, 'seconds': 0.0, 'figure_seconds': 0.0,
+                            'serialization_seconds': 0.0, 'other_seconds': 0.0, 'response_bytes': 0,
+                            'buckets': [0] * len(self.buckets)}
+                self._callbacks[name] = callback
+
+            callback['requests'] += 1
+            callback['cache_hits'] += int(cache_hit)
+            callback['seconds'] += seconds
+            callback['figure_seconds'] += figure_seconds
+            callback['serialization_seconds'] += serialization_seconds
+            callback['other_seconds'] += max(seconds - figure_seconds - serialization_seconds, 0.0)
+            callback['response_bytes'] += response_bytes
+            for (i, bound) in enumerate(self.buckets):
+                if seconds <= bound:
+                    callback['buckets'][i] += 1
+        return name
+
+    def render(self):
+        '''
+        Returns the metrics in the Prometheus text exposition format.
+        '''
+        with self._lock:
+            callbacks = {name: dict(values, buckets = list(values['buckets']))
+                         for (name, values) in self._callbacks.items()}
+
+        lines = []
+        def metric(name, type_, help_, samples):
+            lines.append('# HELP {} {}'.format(name, help_))
+            lines.append('# TYPE {} {}'.format(name, type_))
+            for (suffix, labels, value) in samples:
+                labels = ','.join('{}="{}"'.format(key, value_) for (key, value_) in labels)
+                lines.append('{}{}{{{}}} {}'.format(name, suffix, labels, value))
+
+        metric('dash_callback_requests_total', 'counter', 'Callback requests.',
+               [('', [('callback', i)], j['requests']) for (i, j) in callbacks.items()])
+        metric('dash_callback_cache_hits_total', 'counter', 'Callback requests answered by the response cache.',
+               [('', [('callback', i)], j['cache_hits']) for (i, j) in callbacks.items()])
+
+        samples = []
+        for (name, values) in callbacks.items():
+            for (bound, count) in zip(self.buckets, values['buckets']):
+                samples.append(('_bucket', [('callback', name), ('le', repr(bound))], count))
+            samples.append(('_bucket', [('callback', name), ('le', '+Inf')], values['requests']))
+            samples.append(('_sum', [('callback', name)], values['seconds']))
+            samples.append(('_count', [('callback', name)], values['requests']))
+        metric('dash_callback_duration_seconds', 'histogram', 'Callback request wall time.', samples)
+
+        metric('dash_callback_figure_seconds_total', 'counter', 'Time spent building figures.',
+               [('', [('callback', i)], j['figure_seconds']) for (i, j) in callbacks.items()])
+        metric('dash_callback_serialization_seconds_total', 'counter',
+               'Time spent serializing the figures for the figure caches and parsing them back.',
+               [('', [('callback', i)], j['serialization_seconds']) for (i, j) in callbacks.items()])
+        metric('dash_callback_other_seconds_total', 'counter',
+               'Rest of the callback request time, mostly request hooks and the response encoding by Dash.',
+               [('', [('callback', i)], j['other_seconds']) for (i, j) in callbacks.items()])
+        metric('dash_callback_response_bytes_total', 'counter', 'Uncompressed callback response bytes.',
+               [('', [('callback', i)], j['response_bytes']) for (i, j) in callbacks.items()])
+
+        caches = {name: cache.stats() for (name, cache) in self._caches.items()}
+        metric('dash_cache_hits_total', 'counter', 'Cache hits.',
+               [('', [('cache', i)], j['hits']) for (i, j) in caches.items()])
+        metric('dash_cache_misses_total', 'counter', 'Cache misses.',
+               [('', [('cache', i)], j['misses']) for (i, j) in caches.items()])
+        metric('dash_cache_entries', 'gauge', 'Entries held in the cache.',
+               [('', [('cache', i)], j['size']) for (i, j) in caches.items()])
+        metric('dash_cache_prefetch_hits_total', 'counter', 'Cache hits on figures stored by a prefetcher.',
+               [('', [('cache', i)], j['prefetch_hits']) for (i, j) in caches.items() if 'prefetch_hits' in j])
+
+        prefetchers = {name: prefetcher.stats() for (name, prefetcher) in self._prefetchers.items()}
+        metric('dash_prefetch_scheduled_total', 'counter', 'Figures scheduled for prefetching.',
+               [('', [('prefetcher', i)], j['scheduled']) for (i, j) in prefetchers.items()])
+        metric('dash_prefetch_dropped_total', 'counter', 'Prefetches dropped because the queue was full.',
+               [('', [('prefetcher', i)], j['dropped']) for (i, j) in prefetchers.items()])
+        metric('dash_prefetch_built_total', 'counter', 'Figures built and cached by prefetching.',
+               [('', [('prefetcher', i)], j['built']) for (i, j) in prefetchers.items()])
+        metric('dash_prefetch_errors_total', 'counter', 'Prefetches that raised an exception.',
+               [('', [('prefetcher', i)], j['errors']) for (i, j) in prefetchers.items()])
+        metric('dash_prefetch_pending', 'gauge', 'Prefetches queued or running.',
+               [('', [('prefetcher', i)], j['pending']) for (i, j) in prefetchers.items()])
+
+        return '\n'.join(lines) + '\n'
+
+
+def install_metrics(server, metrics, path_ = '/metrics', callback_path = '/_dash-update-component'):
+    '''
+    Records every Dash callback request of a Flask server in metrics and serves them
+    at path_ in the Prometheus text format.
+
+    Install it before install_response_layer, so the requests answered by the
+    response cache are recorded and counted as cache hits.
+
+    input parameters:
+        server: The Flask server of the Dash app
+        metrics: A CallbackMetrics, with the callbacks wrapped by metrics.instrument
+        path_: Path of the metrics endpoint
+        callback_path: Path of the Dash callback endpoint
+    '''
+    @server.before_request
+    def start_callback_request():
+        if flask.request.method != 'POST' or flask.request.path != callback_path:
+            return None
+        flask.g.metrics_start = time.perf_counter()
+        if metrics.profile_dir:
+            flask.g.profiler = cProfile.Profile()
+            flask.g.profiler.enable()
+        return None
+
+    @server.after_request
+    def record_callback_request(response):
+        start = flask.g.get('metrics_start')
+        if start is None:
+            return response
+        seconds = time.perf_counter() - start
+
+        output = (flask.request.get_json(silent = True) or {}).get('output')
+        serialization_seconds = flask.g.get('figure_serialization_seconds', 0.0)
+        figure_seconds = flask.g.get('figure_build_seconds')
+        if figure_seconds is None:
+            figure_seconds = max(flask.g.get('callback_function_seconds', 0.0) - serialization_seconds, 0.0)
+        name = metrics.record(output, flask.g.get('callback_name'), seconds, figure_seconds, serialization_seconds,
+                              len(response.get_data()),
+                              bool(flask.g.get('callback_cache_hit')))
+
+        profiler = flask.g.get('profiler')
+        if profiler is not None:
+            profiler.disable()
+            os.makedirs(metrics.profile_dir, exist_ok = True)
+            profiler.dump_stats(join(metrics.profile_dir, '{}-{}.prof'.format(name, time.time_ns())))
+        return response
+
+    @server.route(path_)
+    def serve_metrics():
+        return flask.Response(metrics.render(), mimetype = 'text/plain; version=0.0.4')
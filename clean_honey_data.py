@@ -1,11 +1,19 @@
 import pandas as pd
 import numpy as np
-import seaborn as sns
-from matplotlib import pyplot as plt
 import re
+import io
+import os
+import json
+import pickle
+import hashlib
+import sys
 from os import listdir
-from os.path import isfile, join
+from os.path import abspath, basename, dirname, isfile, join, splitext
+from concurrent.futures import ProcessPoolExecutor
+from zipfile import ZipFile, is_zipfile
+import plotly
 import plotly.graph_objects as go
+from pandas.api.types import is_categorical_dtype
 
 
 us_state_abbrev = {
@@ -69,15 +77,124 @@ us_state_abbrev = {
 
 abbrev_us_state = dict(map(reversed, us_state_abbrev.items()))
 
+#FIPS code of each state and territory, by abbreviation
+STATE_FIPS = {
+    'AL': 1, 'AK': 2, 'AZ': 4, 'AR': 5, 'CA': 6, 'CO': 8, 'CT': 9, 'DE': 10, 'DC': 11, 'FL': 12, 'GA': 13,
+    'HI': 15, 'ID': 16, 'IL': 17, 'IN': 18, 'IA': 19, 'KS': 20, 'KY': 21, 'LA': 22, 'ME': 23, 'MD': 24,
+    'MA': 25, 'MI': 26, 'MN': 27, 'MS': 28, 'MO': 29, 'MT': 30, 'NE': 31, 'NV': 32, 'NH': 33, 'NJ': 34,
+    'NM': 35, 'NY': 36, 'NC': 37, 'ND': 38, 'OH': 39, 'OK': 40, 'OR': 41, 'PA': 42, 'RI': 44, 'SC': 45,
+    'SD': 46, 'TN': 47, 'TX': 48, 'UT': 49, 'VT': 50, 'VA': 51, 'WA': 53, 'WV': 54, 'WI': 55, 'WY': 56,
+    'MP': 69, 'PW': 70, 'PR': 72, 'VI': 78,
+}
+
+
+class StateRegistry:
+    '''
+    Immutable registry of the states and territories. Every state has an int8 id,
+    its position in the registry, and the names, codes and FIPS codes are read-only
+    NumPy arrays indexed by id, so translating an array of ids is a single take.
+    Names and codes are interned.
+    
+    input parameters:
+        abbreviations: Dictionary mapping state names to codes, in id order. Ex: us_state_abbrev
+        fips: Dictionary mapping state codes to FIPS codes. Ex: STATE_FIPS
+    '''
+    
+    def __init__(self, abbreviations, fips):
+        self.names = np.array([sys.intern(i) for i in abbreviations], dtype = object)
+        self.codes = np.array([sys.intern(i) for i in abbreviations.values()], dtype = object)
+        self.fips = np.array([fips[i] for i in self.codes], dtype = np.int8)
+        self.ids = np.arange(len(self.names), dtype = np.int8)
+        #names then codes, so a position modulo the number of states is an id
+        self._index = pd.Index(np.concatenate([self.names, self.codes]))
+        self.dropdown = tuple({'label': i, 'value': i} for i in self.names)
+        for i in (self.names, self.codes, self.fips, self.ids):
+            i.flags.writeable = False
+    
+    def __len__(self):
+        return len(self.names)
+    
+    def lookup(self, values):
+        '''
+        Returns the int8 ids of an array of state names or codes, -1 for the values
+        that are not in the registry.
+        '''
+        positions = self._index.get_indexer(np.asarray(values, dtype = object))
+        return np.where(positions < 0, -1, positions % len(self)).astype(np.int8)
+    
+    def categoricals(self, values):
+        '''
+        Returns the state names and the state codes of an array of state names or
+        codes as two categoricals built on one code array. A dataframe holding them
+        keeps a copy of the codes per column. The categories are the registry
+        names and codes, so the codes are the state ids; values that are not in the
+        registry are kept as they are, as categories after the registry ones.
+        
+        returns:
+            state: Categorical of state names
+            state_code: Categorical of state codes
+        '''
+        codes, uniques = pd.factorize(np.asarray(values, dtype = object))
+        ids = self.lookup(uniques).astype(np.int16)
+        unknown = uniques[ids < 0]
+        ids[ids < 0] = len(self) + np.arange(len(unknown))
+        
+        #one code array, in the dtype pandas picks for the number of categories, so both
+        #categoricals keep it without a copy
+        categories = (np.concatenate([self.names, unknown]), np.concatenate([self.codes, unknown]))
+        state_ids = pd.Categorical.from_codes(ids[codes], categories[0]).codes
+        state = pd.Categorical.from_codes(state_ids, categories[0])
+        state_code = pd.Categorical.from_codes(state_ids, categories[1])
+        return (state, state_code)
+
+
+STATES = StateRegistry(us_state_abbrev, STATE_FIPS)
+
+#Data directories, relative to this file so the pipeline can run from anywhere
+DATA_DIR = dirname(abspath(__file__))
+COLONY_PATH = join(DATA_DIR, 'colony_data')
+PRODUCTION_PATH = join(DATA_DIR, 'production_data')
+PESTICIDE_PATH = join(DATA_DIR, 'pesticide_data.csv')
+#The release archives as downloaded from NASS, see read_usda_rows
+COLONY_ARCHIVE_PATH = join(DATA_DIR, 'honey_colony_data')
+PRODUCTION_ARCHIVE_PATH = join(DATA_DIR, 'honey_production_data')
+INGEST_CACHE_PATH = join(DATA_DIR, '.ingest_cache')
+
+#USDA releases are exported from Excel on Windows
+USDA_ENCODING = 'cp1252'
+#Name of the csv file holding every table of a release archive. Ex: 'hony_all.csv', 'hcny_all_tables.csv'
+RELEASE_TABLES_FILE = re.compile(r'^(hony|hcny)_all(_tables)?\.csv$', re.IGNORECASE)
+#Years between the first year of data in a release and its release date, by release kind
+RELEASE_YEAR_OFFSETS = {'hony': 2, 'hcny': 1}
+#First bytes of an Excel 97-2003 (BIFF) workbook
+XLS_SIGNATURE = b'\xd0\xcf\x11\xe0'
+
+#Data columns of the colony count and colony stressor tables, after the state name
+COLONY_COLUMNS = ["state", "initial_count", "max", "lost", "lost_perc", "added", "renovated", "renovated_perc"]
+DISEASE_COLUMNS = ["state", "varroa_mites", "other_pests", "diseases", "pesticides", "other", "unknown"]
+PRODUCTION_COLUMNS = ["state", "honey_colonies", "yield_per_col", "production", "stocks", "avg_price_per_lb", "prod_value"]
+
+#Column dtypes of the colony and honey production datasets, see apply_schema
+COLONY_SCHEMA = dict({'state': 'category', 'state_code': 'category', 'quarter': 'category', 'period': 'category',
+                      'year': 'int16'}, **{i: 'float32' for i in DISEASE_COLUMNS[1:] + COLONY_COLUMNS[1:]})
+HONEY_SCHEMA = dict({'state': 'category', 'state_code': 'category', 'year': 'int16'},
+                    **{i: 'float32' for i in PRODUCTION_COLUMNS[1:]})
+
+#Colony stressors and production values correlated by rolling_correlations
+CORRELATION_COLUMNS = ["varroa_mites", "other_pests", "diseases", "pesticides", "other", "unknown", "lost_perc"]
+CORRELATION_TARGETS = ["yield_per_col", "avg_price_per_lb", "production"]
+
+#Columns kept from the USDA Pesticide Data Program residue file, and their new names
+PESTICIDE_COLUMNS = {"Sample ID": "sample_id", "Pesticide Code": "pesticide_code", "Pesticide Name": "pesticide_name",
+                     "Test Class": "test_class", "Concentration": "concentration", "LOD": "lod",
+                     "EPA Tolerance (ppm)": "epa_tolerance"}
+
 def get_state_dropdown():
-    dict_list= []
-    for i in us_state_abbrev.keys():
-        dict_list.append({'label': i, 'value': i})
-    return dict_list
+    return [dict(i) for i in STATES.dropdown]
 
 
 def get_state_names():
-    return list(us_state_abbrev.keys())
+    return list(STATES.names)
 
 def remove_chars(input_):
     '''
@@ -91,6 +208,197 @@ def remove_chars(input_):
     output_list = [re.sub(r'^"|"$', '', i) for i in output_]
     return output_list
 
+def get_release_member(archive):
+    '''
+    Returns the name of the csv file holding every table of a release in a zip archive.
+    
+    input parameters:
+        archive: An open ZipFile
+    '''
+    for name in archive.namelist():
+        if RELEASE_TABLES_FILE.match(basename(name)):
+            return name
+    raise ValueError('{} holds no USDA all tables csv file'.format(archive.filename))
+
+
+def read_xls_rows(file_):
+    '''
+    Reads the rows of the first sheet of an Excel 97-2003 workbook as lists of
+    strings, writing whole numbers without a decimal part like the csv releases do.
+    The sheet is read with ragged rows, so every row ends at its last cell like in
+    the csv releases instead of being padded to the width of the sheet, since the
+    cleaning functions tell the tables apart by the width of their rows.
+    Requires xlrd, an optional dependency imported here since only the cleaning
+    pipeline needs it, and only for the Excel releases.
+    '''
+    try:
+        import xlrd
+    except ImportError:
+        raise ImportError('xlrd is required to read the Excel workbook ' + file_)
+    
+    sheet = xlrd.open_workbook(file_, on_demand = True, ragged_rows = True).sheet_by_index(0)
+    for i in range(sheet.nrows):
+        yield [str(int(j)) if isinstance(j, float) and j.is_integer() else str(j) for j in sheet.row_values(i)]
+
+
+def read_usda_rows(file_):
+    '''
+    Lazily reads a USDA release file one line at a time, yielding each line
+    as a list of fields with unwanted characters removed.
+    The releases are published with Windows-1252 encoding.
+    
+    The release can be a csv file, a zip archive as published by NASS, whose all
+    tables csv file is streamed without extracting it, or an Excel workbook.
+    Most of the .xls releases are csv files, which are read as such.
+
+    input parameters:
+        file_: string containing file path
+
+    yields:
+        row: A list containing the fields of a single line
+    '''
+    if is_zipfile(file_):
+        with ZipFile(file_) as archive, archive.open(get_release_member(archive)) as f:
+            for line in io.TextIOWrapper(f, encoding=USDA_ENCODING, errors='replace'):
+                yield remove_chars(line)
+        return
+    
+    with open(file_, 'rb') as f:
+        is_workbook = f.read(len(XLS_SIGNATURE)) == XLS_SIGNATURE
+    if is_workbook:
+        yield from read_xls_rows(file_)
+        return
+    
+    with open(file_, encoding=USDA_ENCODING, errors='replace') as f:
+        for line in f:
+            yield remove_chars(line)
+
+
+def iter_colony_blocks(rows):
+    '''
+    Single pass state machine over the rows of a USDA colony release.
+    Data rows (row type 'd') are routed by their width: colony count tables have
+    10 columns and stressor (disease) tables have 9. A table block opens on the
+    Alabama row and closes on the Wyoming row of the same table number, and each
+    block is labeled with the next quarter for its table kind.
+
+    input parameters:
+        rows: An iterable of rows as produced by read_usda_rows
+
+    yields:
+        (kind, quarter, values): kind is either 'colony' or 'disease', quarter is
+                                 the block label (Q1, Q2, ...) and values are the
+                                 row fields starting at the state name
+    '''
+    kinds = {10: 'colony', 9: 'disease'}
+    open_tables = {'colony': None, 'disease': None}
+    block_counts = {'colony': 0, 'disease': 0}
+
+    for row in rows:
+        if len(row) < 3 or row[1] != 'd' or len(row) not in kinds:
+            continue
+
+        kind = kinds[len(row)]
+        table_no, state = row[0], row[2]
+
+        if open_tables[kind] is None:
+            if state != 'Alabama':
+                continue
+            open_tables[kind] = table_no
+            block_counts[kind] += 1
+        elif open_tables[kind] != table_no:
+            continue
+
+        #the Wyoming row closes the block and is not part of it
+        if state == 'Wyoming':
+            open_tables[kind] = None
+            continue
+
+        yield (kind, 'Q' + str(block_counts[kind]), row[2:])
+
+
+def iter_production_blocks(rows):
+    '''
+    Single pass state machine over the rows of a USDA honey production release.
+    Production tables have 9 columns. A table block opens on the Alabama row and
+    closes on the Wyoming row, and each block is labeled with the next quarter,
+    which clean_production_data turns into a year. Older releases use the state
+    abbreviations instead of the names.
+
+    input parameters:
+        rows: An iterable of rows as produced by read_usda_rows
+
+    yields:
+        (quarter, values): quarter is the block label (Q1, Q2, ...) and values are
+                           the row fields starting at the state name
+    '''
+    block_open = False
+    block_count = 0
+
+    for row in rows:
+        if len(row) != 9 or row[1] != 'd':
+            continue
+
+        state = row[2]
+        if not block_open:
+            if state not in ('Alabama', 'AL'):
+                continue
+            block_open = True
+            block_count += 1
+
+        #the Wyoming row closes the block and is not part of it
+        if state in ('Wyoming', 'WY'):
+            block_open = False
+            continue
+
+        yield ('Q' + str(block_count), row[2:])
+
+
+def set_column_types(input_, categoricals = ('state', 'quarter')):
+    '''
+    Sets the column data types of a freshly parsed USDA table. Every non categorical
+    column is converted to floats in one vectorized pass over the whole numeric block:
+    suppressed values '(X)' and '-' become NaN and '(Z)' (less than half the unit) becomes 0.
+    
+    input parameters:
+        input_: Dataframe with the raw string values of a table
+        categoricals: Names of the columns that are kept as strings
+    
+    returns:
+        output_: Dataframe with float columns, downcast to float32 where possible
+    '''
+    numeric_cols = [i for i in input_.columns if i not in categoricals]
+    
+    block = pd.Series(input_[numeric_cols].to_numpy(dtype = object).ravel())
+    block = pd.to_numeric(block.replace('(Z)', '0'), errors = 'coerce')
+    block = block.to_numpy(dtype = float).reshape(len(input_), len(numeric_cols))
+    
+    columns = {}
+    for i in input_.columns:
+        if i in categoricals:
+            columns[i] = input_[i].astype(str).to_numpy()
+        else:
+            columns[i] = pd.to_numeric(block[:, numeric_cols.index(i)], downcast = 'float')
+    
+    return pd.DataFrame(columns, index = input_.index)
+
+
+def map_state_columns(input_):
+    '''
+    Replaces state abbreviations with full state names and adds the state_code column.
+    Both columns are categorical over the STATES registry, so their codes are the
+    int8 state ids and each lookup runs once per distinct state instead of once per row.
+    
+    input parameters:
+        input_: Dataframe with a state column
+    
+    returns:
+        output_: Dataframe with categorical state and state_code columns
+    '''
+    state, state_code = STATES.categoricals(input_.state)
+    return input_.assign(state = state, state_code = state_code)
+
+
 def clean_colony_data(file_):
     '''
     Reads in the USDA honey colony data files and outputs 2 cleaned dataframes
@@ -104,184 +412,427 @@ def clean_colony_data(file_):
         colony_df: Dataframe containing data of colony counts per state
         disease_df: Dataframe containing the colony disease counts per state
     '''
-    #Remove unwanted characters in file lines
-    f = [remove_chars(i) for i in open(file_)]
+    #Stream the file once, collecting the rows of each table kind straight into columns
+    column_names = {'colony': COLONY_COLUMNS + ['quarter'],
+                    'disease': DISEASE_COLUMNS + ['quarter']}
+    columns = {kind: {name: [] for name in names} for (kind, names) in column_names.items()}
+
+    for (kind, quarter, values) in iter_colony_blocks(read_usda_rows(file_)):
+        table = columns[kind]
+        for (name, value) in zip(column_names[kind], values):
+            table[name].append(value)
+        table['quarter'].append(quarter)
+
+    #Convert the cleaned data into dataframes
+    colony_df = pd.DataFrame(columns['colony'], columns = column_names['colony'])
+    disease_df = pd.DataFrame(columns['disease'], columns = column_names['disease'])
+
+    #Set column data types and drop the blank separator rows
+    colony_df = set_column_types(colony_df)
+    disease_df = set_column_types(disease_df)
+
+    colony_df = colony_df[colony_df.state != ""]
+    disease_df = disease_df[disease_df.state != ""]
+
+    colony_df = map_state_columns(colony_df)
+    disease_df = map_state_columns(disease_df)
+    
+    return (colony_df, disease_df)  
+
+
+
+
+
+
+def clean_production_data(file_):
+    '''
+    Reads in a USDA honey production release in a single pass and outputs a cleaned
+    dataframe with the production data per state of every table in the release.
     
-    #looking at the excel table we know that colony data has 10 columns
-    #disease data has nine columns, and that these rowtypes are classified
-    #as data rows with character 'd'. Thus we subset these specific
-    #data rows by their lengths.
+    input parameters: 
+        file_: string containing file path 
+        
+    returns:
+        prod_df: Dataframe containing the honey production per state, with the
+                 table it comes from in the quarter column (Q1, Q2, ...)
+    '''
+    #The production tables are the data rows with nine columns. Each table runs from
+    #Alabama to Wyoming and holds one year, see iter_production_blocks
+    rows = [values + [quarter] for (quarter, values) in iter_production_blocks(read_usda_rows(file_))]
     
-    colony_data = [i for i in f if len(i) == 10 for j in i if j == 'd']
-    disease_data = [i for i in f if len(i) == 9 for j in i if j == 'd']
+    #Convert the cleaned data into dataframes
+    prod_df = pd.DataFrame(rows, columns = PRODUCTION_COLUMNS + ['quarter'])
     
-    #The data for each quarter starts with Alabama and ends with the United States total
-    #By getting these indexes, we can separate all quarters in the file
-    colony_start_indexes = [colony_data.index(colony_data[i]) for i in range(len(colony_data)) for j in colony_data[i] if j == 'Alabama']
-    disease_start_indexes = [disease_data.index(disease_data[i]) for i in range(len(disease_data)) for j in disease_data[i] if j == 'Alabama']
+    #set column data types
+    prod_df = set_column_types(prod_df)
+
+    prod_df = prod_df[prod_df.state != ""]
+    prod_df = map_state_columns(prod_df)
+    
+    return prod_df  
+
+
+def clean_pesticide_data(file_):
+    '''
+    Reads in the USDA Pesticide Data Program honey residue file and outputs a cleaned
+    dataframe with one row per residue detected in a sample.
+    The sample ids start with the state abbreviation and the collection date,
+    Ex: 'CA0710100004HYUS2' is a California sample collected on 2007-10-10.
+    Rows whose sample id does not start that way are dropped, since they cannot be
+    given a state and year.
+    The EPA tolerance is NaN for the pesticides without one ('NT') or exempt from
+    one ('EX'), which are kept in the tolerance_note column.
     
-    colony_end_indexes = [colony_data.index(colony_data[i]) for i in range(len(colony_data)) for j in colony_data[i] if j == 'Wyoming']
-    disease_end_indexes = [disease_data.index(disease_data[i]) for i in range(len(disease_data)) for j in disease_data[i] if j == 'Wyoming']
+    input parameters: 
+        file_: string containing file path 
+        
+    returns:
+        pesticide_df: Dataframe containing the residue detections per state and year
+    '''
+    raw_df = pd.read_csv(file_, encoding = USDA_ENCODING, dtype = str, keep_default_na = False,
+                         usecols = list(PESTICIDE_COLUMNS))
+    raw_df = raw_df.rename(columns = PESTICIDE_COLUMNS)
     
-    #subset the data by with the index values collected
-    colony_subsets = [colony_data[colony_start_indexes[i]: colony_end_indexes[i]] for i in range(len(colony_start_indexes))]    
-    quarters = ['Q1', 'Q2', 'Q3', 'Q4', 'Q5', 'Q6', 'Q7', 'Q8']
+    #Parse the state and collection date out of every sample id at once
+    sample_info = raw_df.sample_id.str.extract(r'^(?P<state>[A-Z]{2})(?P<year>\d{2})(?P<month>\d{2})')
+    parsed = sample_info.year.notna()
+    raw_df = raw_df[parsed]
+    sample_info = sample_info[parsed]
     
-    #append the quarter labels
-    for i in range(len(colony_subsets)):
-        for j in colony_subsets[i]:
-            j.append(quarters[i])
+    pesticide_df = set_column_types(raw_df, categoricals = ('sample_id', 'pesticide_code', 'pesticide_name', 'test_class'))
+    pesticide_df['tolerance_note'] = raw_df.epa_tolerance.where(pesticide_df.epa_tolerance.isna(), '')
+    pesticide_df['state'] = sample_info.state
+    pesticide_df['year'] = 2000 + sample_info.year.astype(int)
+    pesticide_df['month'] = sample_info.month.astype(int)
+    pesticide_df = map_state_columns(pesticide_df)
     
-    cleaned_colony_data = [j for i in colony_subsets for j in i]
+    #the ratio is taken at full precision, float32 values would add digits to it
+    pesticide_df['tolerance_ratio'] = pd.to_numeric(raw_df.concentration, errors = 'coerce') / \
+                                      pd.to_numeric(raw_df.epa_tolerance, errors = 'coerce')
+    pesticide_df['exceeds_tolerance'] = pesticide_df.tolerance_ratio > 1
     
-    #Subset the disease data and append the quarter labels
-    disease_subsets = [disease_data[disease_start_indexes[i]: disease_end_indexes[i]] for i in range(len(disease_start_indexes))]    
-    for i in range(len(disease_subsets)):
-        for j in disease_subsets[i]:
-            j.append(quarters[i])
+    first_cols = ['state', 'state_code', 'year', 'month']
+    return pesticide_df[first_cols + [i for i in pesticide_df.columns if i not in first_cols]]
+
+
+def aggregate_pesticide_data(input_):
+    '''
+    Summarizes the cleaned residue detections per state and year.
     
-    cleaned_disease_data = [j for i in disease_subsets for j in i]
+    input parameters:
+        input_: Dataframe produced by clean_pesticide_data
     
-    #Convert the cleaned data into dataframes
-    colony_df = pd.DataFrame(cleaned_colony_data)
-    colony_df.columns = ["table_no", "row_type", "state", "initial_count", "max", "lost", "lost_perc", "added", "renovated", "renovated_perc", "quarter"]
+    returns:
+        output_: Dataframe with one row per state and year with the number of samples,
+                 detections and distinct pesticides, the number of detections over
+                 their EPA tolerance or without one, and the maximum concentration
+                 and concentration to tolerance ratio
+    '''
+    groups = input_.assign(no_tolerance = input_.tolerance_note == 'NT') \
+                   .groupby(['state', 'year'], observed = True)
     
-    disease_df = pd.DataFrame(cleaned_disease_data)
-    disease_df.columns = ["table_no", "row_type", "state", "varroa_mites", "other_pests", "diseases", "pesticides", "other", "unknown", "quarter"]
+    output_ = groups.agg(samples = ('sample_id', 'nunique'),
+                         detections = ('sample_id', 'size'),
+                         pesticides = ('pesticide_name', 'nunique'),
+                         exceedances = ('exceeds_tolerance', 'sum'),
+                         no_tolerance = ('no_tolerance', 'sum'),
+                         max_concentration = ('concentration', 'max'),
+                         max_tolerance_ratio = ('tolerance_ratio', 'max'))
     
-    #drop unwanted columns and replace non numeric chars
-    colony_df.drop(columns=['table_no', 'row_type'], inplace = True)
-    disease_df.drop(columns=['table_no', 'row_type'], inplace = True)
-
-    colony_df.replace(['(X)', '-'], "", inplace = True)
-    colony_df.replace(['(Z)'], "0", inplace = True)
+    return output_.reset_index()
 
-    disease_df.replace(['(X)', '-'], '', inplace = True)
-    disease_df.replace(['(Z)'], '0', inplace = True)
 
-    #Set column data types
-    categoricals = ['state', 'quarter']
-    for (columnName, columnData) in colony_df.iteritems():
-        if(columnName not in categoricals):
-            colony_df[columnName] = pd.to_numeric(colony_df[columnName], errors = 'coerce', downcast = 'float')
-        else:
-            colony_df[columnName] = colony_df[columnName].astype(str)
+def index_pesticide_aggregates(input_):
+    '''
+    Turns the per state and year aggregates into a dictionary, so a view can get the
+    summary of one state and year with a single lookup.
+    
+    input parameters:
+        input_: Dataframe produced by aggregate_pesticide_data, or loaded from
+                all_pesticide_data.csv
+    
+    returns:
+        A dictionary mapping (state, year) to a dictionary of the aggregate values
+        Ex: {('California', 2007): {'samples': 20, 'detections': 24, ...}, ...}
+    '''
+    return input_.set_index(['state', 'year']).to_dict(orient = 'index')
 
 
-    for (columnName, columnData) in disease_df.iteritems():
-        if(columnName not in categoricals):
-            disease_df[columnName] = pd.to_numeric(disease_df[columnName], errors = 'coerce', downcast = 'float')
-        else:
-            disease_df[columnName] = disease_df[columnName].astype(str)
+def get_release_kind(file_):
+    '''
+    Returns 'hony' for a honey production release, 'hcny' for a colony release and
+    None for any other file, from the file name or from the tables file of an archive.
+    Ex: 'hony_all_tables_2017-2018.csv' and 'Hone-03-14-2018.zip' return 'hony'
+    '''
+    name = basename(file_).lower()
+    if is_zipfile(file_):
+        with ZipFile(file_) as archive:
+            try:
+                name = basename(get_release_member(archive)).lower()
+            except ValueError:
+                return None
     
-    colony_df = colony_df[colony_df.state != ""]
-    disease_df = disease_df[disease_df.state != ""]
+    for kind in RELEASE_YEAR_OFFSETS:
+        if name.startswith(kind):
+            return kind
+    return None
+
+
+def get_source_files(path_, kind = None):
+    '''
+    Returns the paths of the USDA release files in a data directory, sorted so that
+    releases are always processed in chronological order.
     
-    colony_df.state = [abbrev_us_state[i] if i in list(abbrev_us_state.keys()) else i for i in colony_df.state]
-    colony_df['state_code'] = [us_state_abbrev[i] if i in list(us_state_abbrev.keys()) else i for i in colony_df.state]
+    input parameters:
+        path_: directory containing the releases
+        kind: When given, only the releases of this kind ('hony' or 'hcny') are
+              returned, sorted by release year. Otherwise every file is returned,
+              sorted by name.
+    '''
+    files = [join(path_, f) for f in sorted(listdir(path_)) if isfile(join(path_, f))]
+    if kind is None:
+        return files
     
-    disease_df.state = [abbrev_us_state[i] if i in list(abbrev_us_state.keys()) else i for i in disease_df.state]
-    disease_df['state_code'] = [us_state_abbrev[i] if i in list(us_state_abbrev.keys()) else i for i in disease_df.state]
+    files = [f for f in files if get_release_kind(f) == kind]
+    return sorted(files, key = get_release_year)
+
+
+def get_release_year(file_):
+    '''
+    Returns the first year of a USDA release from its file name, or for the
+    archives named after their release date, from the release date in the title
+    of their first table.
+    Ex: 'hony_all_tables_2017-2018.csv' returns 2017
+        'Hone-03-14-2018.zip', released March 14, 2018, returns 2016
+    '''
+    match = re.search(r'(\d{4})-\d{4}', basename(file_))
+    if match:
+        return int(match.group(1))
     
-    return (colony_df, disease_df)  
+    for row in read_usda_rows(file_):
+        released = re.search(r'Released \w+ \d+, (\d{4})', ','.join(row))
+        if released:
+            return int(released.group(1)) - RELEASE_YEAR_OFFSETS[get_release_kind(file_)]
+    raise ValueError('No release date found in ' + file_)
 
 
+def file_digest(file_):
+    '''
+    Returns the sha1 hex digest of a file's contents
+    '''
+    digest = hashlib.sha1()
+    with open(file_, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
 
 
+def get_data_version(files):
+    '''
+    Returns a content hash of a set of dataset files, which changes whenever any
+    of them is regenerated with different contents. Caches of anything derived
+    from the datasets key their entries by it.
+    
+    input parameters:
+        files: paths of the dataset files. Ex: ['all_honey_data.csv', 'all_colony_data.csv']
+    '''
+    digest = hashlib.sha1()
+    for file_ in files:
+        digest.update(file_digest(file_).encode('ascii'))
+    return digest.hexdigest()
 
 
-def clean_production_data(file_):
+def clean_files(clean_function, files, workers = 1, cache_dir = None):
     '''
-    Reads in the USDA honey colony data files and outputs 2 cleaned dataframes
-    One pertaining to the colony count data per state, and the second dataframe containing
-    the colony diseases per state.
+    Applies a cleaning function to every file, optionally spreading the files
+    across a pool of worker processes. Results are always returned in file order.
+    
+    input parameters:
+        clean_function: clean_production_data or clean_colony_data
+        files: list of file paths
+        workers: Number of worker processes. 1 cleans the files in this process,
+                 None uses one process per CPU.
+        cache_dir: When given, cleaned outputs are stored in this directory and
+                   only new or changed files are cleaned, see clean_files_incremental
     
-    input parameters: 
-        file_: string containing file path 
-        
     returns:
-        colony_df: Dataframe containing data of colony counts per state
-        disease_df: Dataframe containing the colony disease counts per state
+        A list with the output of clean_function for each file
     '''
-    #Remove unwanted characters in file lines
-    f = [remove_chars(i) for i in open(file_)]
+    if cache_dir is not None:
+        return clean_files_incremental(clean_function, files, cache_dir, workers)
     
-    #looking at the excel table we know that colony data has 10 columns
-    #disease data has nine columns, and that these rowtypes are classified
-    #as data rows with character 'd'. Thus we subset these specific
-    #data rows by their lengths.
+    if workers == 1 or len(files) <= 1:
+        return [clean_function(i) for i in files]
     
-    prod_data = [i for i in f if len(i) == 9 for j in i if j == 'd']
+    with ProcessPoolExecutor(max_workers = workers) as executor:
+        return list(executor.map(clean_function, files))
+
+
+def clean_files_incremental(clean_function, files, cache_dir, workers = 1):
+    '''
+    Incremental version of clean_files. A manifest in cache_dir records the size,
+    modification time and sha1 digest of every cleaned file, and the cleaned output
+    of each file is pickled next to it. Files whose size and modification time are
+    unchanged, or whose contents hash to the recorded digest, are loaded from their
+    pickle; only new or changed files are cleaned.
+    The manifest also records the digest of this module, so any change to the
+    cleaning code invalidates every stored output.
     
-    #The data for each quarter starts with Alabama and ends with the United States total
-    #By getting these indexes, we can separate all quarters in the file
-    prod_start_indexes = [prod_data.index(prod_data[i]) for i in range(len(prod_data)) for j in prod_data[i] if j == 'Alabama' or j == 'AL'] 
-    prod_end_indexes = [prod_data.index(prod_data[i]) for i in range(len(prod_data)) for j in prod_data[i] if j == 'Wyoming' or j == 'WY']
-   
-    #subset the data by with the index values collected
-    prod_subsets = [prod_data[prod_start_indexes[i]: prod_end_indexes[i]] for i in range(len(prod_start_indexes))]    
-    quarters = ['Q1', 'Q2', 'Q3', 'Q4', 'Q5', 'Q6', 'Q7', 'Q8']
+    input parameters:
+        clean_function: clean_production_data or clean_colony_data
+        files: list of file paths
+        cache_dir: directory holding the manifest and the cleaned outputs
+        workers: Number of worker processes used for the files that need cleaning
     
-    #append the quarter labels
-    for i in range(len(prod_subsets)):
-        for j in prod_subsets[i]:
-            j.append(quarters[i])
+    returns:
+        A list with the output of clean_function for each file
+    '''
+    os.makedirs(cache_dir, exist_ok = True)
+    manifest_file = join(cache_dir, 'manifest.json')
+    pipeline = file_digest(abspath(__file__))
     
-    cleaned_prod_data = [j for i in prod_subsets for j in i]
+    manifest = {}
+    if isfile(manifest_file):
+        with open(manifest_file) as f:
+            manifest = json.load(f)
+    if manifest.get('pipeline') != pipeline:
+        manifest = {'pipeline': pipeline, 'files': {}}
+    entries = manifest['files']
     
+    results = [None] * len(files)
+    stale = []
+    for (i, file_) in enumerate(files):
+        key = clean_function.__name__ + ':' + abspath(file_)
+        stat_ = os.stat(file_)
+        entry = entries.get(key)
+        
+        if entry is not None and (entry['mtime'], entry['size']) != (stat_.st_mtime, stat_.st_size):
+            if entry['sha1'] == file_digest(file_):
+                entry.update(mtime = stat_.st_mtime, size = stat_.st_size)
+            else:
+                entry = None
+        
+        artifact = entry is not None and join(cache_dir, entry['artifact'])
+        if artifact and isfile(artifact):
+            with open(artifact, 'rb') as f:
+                results[i] = pickle.load(f)
+        else:
+            stale.append(i)
     
-    #Convert the cleaned data into dataframes
-    prod_df = pd.DataFrame(cleaned_prod_data)
-    prod_df.columns = ["table_no", "row_type", "state", "honey_colonies", "yield_per_col", "production", 'stocks', 'avg_price_per_lb', 'prod_value', 'quarter']
+    cleaned = clean_files(clean_function, [files[i] for i in stale], workers)
+    for (i, output) in zip(stale, cleaned):
+        file_ = files[i]
+        key = clean_function.__name__ + ':' + abspath(file_)
+        stat_ = os.stat(file_)
+        digest = file_digest(file_)
+        
+        previous = entries.get(key)
+        if previous is not None and isfile(join(cache_dir, previous['artifact'])):
+            os.remove(join(cache_dir, previous['artifact']))
+        
+        entry = {'mtime': stat_.st_mtime, 'size': stat_.st_size, 'sha1': digest,
+                 'artifact': clean_function.__name__ + '-' + digest + '.pkl'}
+        with open(join(cache_dir, entry['artifact']), 'wb') as f:
+            pickle.dump(output, f, protocol = pickle.HIGHEST_PROTOCOL)
+        entries[key] = entry
+        results[i] = output
+    
+    #write the manifest atomically so an interrupted run never leaves it half written
+    with open(manifest_file + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent = 1, sort_keys = True)
+    os.replace(manifest_file + '.tmp', manifest_file)
     
-    #drop unwanted columns and replace non numeric chars
-    prod_df.drop(columns=['table_no', 'row_type'], inplace = True)
+    return results
 
-    prod_df.replace(['(X)', '-'], "", inplace = True)
-    prod_df.replace(['(Z)'], "0", inplace = True)
 
-    #Set column data types
-    categoricals = ['state', 'quarter']
-    for (columnName, columnData) in prod_df.iteritems():
-        if(columnName not in categoricals):
-            prod_df[columnName] = pd.to_numeric(prod_df[columnName], errors = 'coerce', downcast = 'float')
-        else:
-            prod_df[columnName] = prod_df[columnName].astype(str)
-            
-    prod_df = prod_df[prod_df.state != ""]
+def apply_schema(input_, schema):
+    '''
+    Casts the columns of a dataframe to the dtypes of a schema. Columns that already
+    have their dtype are left untouched, so memory mapped columns are not copied
+    and categorical columns keep their categories.
     
-    prod_df.state = [abbrev_us_state[i] if i in list(abbrev_us_state.keys()) else i for i in prod_df.state]
+    input parameters:
+        input_: A dataframe. Ex: colony_data
+        schema: Dictionary mapping column names to dtypes. Ex: COLONY_SCHEMA
     
-    prod_df['state_code'] = [us_state_abbrev[i] if i in list(us_state_abbrev.keys()) else i for i in prod_df.state]
+    returns:
+        output_: Dataframe with the schema dtypes, columns missing from the schema are kept as they are
+    '''
+    dtypes = {}
+    for (name, dtype) in schema.items():
+        if name not in input_.columns:
+            continue
+        if dtype == 'category' and is_categorical_dtype(input_[name].dtype):
+            continue
+        if dtype != 'category' and input_[name].dtype == dtype:
+            continue
+        dtypes[name] = dtype
     
-    return prod_df  
+    return input_.astype(dtypes) if dtypes else input_
+
 
-def get_data():
+def memory_report(input_, schema, name = 'dataframe'):
+    '''
+    Prints the memory used by every column of a dataframe before and after
+    apply_schema, counting the strings of object columns.
+    
+    input parameters:
+        input_: A dataframe. Ex: pd.read_csv('all_colony_data.csv')
+        schema: Dictionary mapping column names to dtypes. Ex: COLONY_SCHEMA
+        name: Name of the dataframe in the report
     
-    #Data paths
-    colony_path = '.\\colony_data'
-    production_path = '.\\production_data'
-    colony_files = [f for f in listdir(colony_path) if isfile(join(colony_path, f))]
-    production_files = [f for f in listdir(production_path) if isfile(join(production_path, f))]
+    returns:
+        before: Bytes used by input_
+        after: Bytes used by input_ with the schema applied
+    '''
+    output_ = apply_schema(input_, schema)
+    before = input_.memory_usage(deep = True, index = False)
+    after = output_.memory_usage(deep = True, index = False)
     
-    colony_files = [colony_path + '\\' + i for i in colony_files]
-    production_files = [production_path + '\\' + i for i in production_files]
+    print('{} ({} rows)'.format(name, len(input_)))
+    print('{:<20}{:>10}{:>12}{:>10}{:>12}'.format('column', 'dtype', 'bytes', 'dtype', 'bytes'))
+    for i in input_.columns:
+        print('{:<20}{:>10}{:>12}{:>10}{:>12}'.format(i, str(input_[i].dtype), before[i], str(output_[i].dtype), after[i]))
+    print('{:<20}{:>10}{:>12}{:>10}{:>12}   {:.0%}'.format('total', '', before.sum(), '', after.sum(),
+                                                           after.sum() / before.sum()))
+    
+    return (int(before.sum()), int(after.sum()))
+
+
+def get_data(workers = 1, colony_path = COLONY_PATH, production_path = PRODUCTION_PATH, cache_dir = None):
+    '''
+    Cleans every USDA release and combines them into the honey production and
+    colony datasets.
+    
+    input parameters:
+        workers: Number of worker processes used to clean the files, see clean_files
+        colony_path: directory containing the colony releases
+        production_path: directory containing the honey production releases
+        cache_dir: When given, only new or changed releases are cleaned and the
+                   rest are loaded from this directory, see clean_files_incremental
+    
+    returns:
+        honey_prod: Dataframe containing yearly honey production per state
+        colony_data: Dataframe containing quarterly colony counts and stressors per state
+    '''
+    colony_files = get_source_files(colony_path, 'hcny')
+    production_files = get_source_files(production_path, 'hony')
     
     #---------------Production Data-----------------------
-    all_prod_data = [clean_production_data(i) for i in production_files]
-    #Get 2018 data from last index Q2
-    prod_2018 = all_prod_data[17]
-    prod_2018 = prod_2018[prod_2018.quarter == 'Q2'].copy()
-    prod_2018['year'] = 2018
+    all_prod_data = clean_files(clean_production_data, production_files, workers, cache_dir)
+    #Q1 of each release holds its first year, and only the latest release
+    #has data for the following year in Q2
+    last_prod = all_prod_data[-1]
+    last_prod = last_prod[last_prod.quarter == 'Q2'].copy()
+    last_prod['year'] = get_release_year(production_files[-1]) + 1
 
-    #Get 2000-2017 year data from Q1
     all_prod_data = [i[i.quarter == 'Q1'].copy() for i in all_prod_data]
-    years = list(range(2000, 2018))
+    years = [get_release_year(i) for i in production_files]
 
     for i in range(len(years)):
         all_prod_data[i].loc[:,'year'] = years[i]
 
-    all_prod_data.append(prod_2018)
+    all_prod_data.append(last_prod)
     honey_prod = pd.concat(all_prod_data)
     honey_prod.drop(columns=['quarter'], inplace = True)
     
@@ -289,7 +840,7 @@ def get_data():
     #----------------Colony Data--------------------------
     
     #clean all separated data
-    all_col_data = [clean_colony_data(i) for i in colony_files]
+    all_col_data = clean_files(clean_colony_data, colony_files, workers, cache_dir)
     all_disease_data = [i[1] for i in all_col_data]
     all_col_data = [i[0] for i in all_col_data]
     
@@ -301,7 +852,7 @@ def get_data():
     all_col_data = [i[i.quarter != 'Q6'] for i in all_col_data]
     
     #Include year data
-    col_years = list(range(2015,2019))
+    col_years = [get_release_year(i) for i in colony_files]
     for i in range(len(all_disease_data)):
         all_disease_data[i].loc[:,'year'] = col_years[i] 
         all_col_data[i].loc[:,'year'] = col_years[i]
@@ -315,15 +866,265 @@ def get_data():
     colony_data = colony_data.loc[:,~colony_data.columns.duplicated()]
     colony_data['period'] = colony_data["year"].map(str) + colony_data["quarter"]
     
-    return (honey_prod, colony_data)
+    return (apply_schema(honey_prod, HONEY_SCHEMA), apply_schema(colony_data, COLONY_SCHEMA))
+
+def join_colony_production(colony_data, honey_data):
+    '''
+    Joins the quarterly colony data with the yearly honey production data of the
+    same state and year, so every colony row carries the production values of its year.
+    Only the years present in both datasets are kept.
+    
+    input parameters:
+        colony_data: Dataframe with the colony data. Ex: all_colony_data.csv
+        honey_data: Dataframe with the honey production data. Ex: all_honey_data.csv
+    
+    returns:
+        output_: Dataframe with the colony columns followed by the production columns
+    '''
+    colony_data = colony_data.astype({'state': str, 'state_code': str})
+    honey_data = honey_data.drop(columns = ['state']).astype({'state_code': str})
+    
+    output_ = colony_data.merge(honey_data, on = ['state_code', 'year'], how = 'inner', sort = False)
+    return output_.sort_values(['period', 'state'], kind = 'mergesort').reset_index(drop = True)
+
+
+def rolling_correlations(input_, columns, targets, window = 4):
+    '''
+    Computes the correlation of each column with each target over a rolling window
+    of periods, pooling the rows of every state in the window. The data is laid out
+    as a (period, state, variable) array and all the windows are computed at once;
+    rows with a missing value are left out of their window.
+    
+    input parameters:
+        input_: Dataframe with state, period, columns and targets. Ex: join_colony_production output
+        columns: Names of the columns to correlate. Ex: ['varroa_mites', 'pesticides']
+        targets: Names of the columns to correlate them with. Ex: ['yield_per_col']
+        window: Number of consecutive periods in each window
+    
+    returns:
+        output_: Dataframe with one row per window, column and target holding the
+                 last period of the window, the number of rows pooled and the correlation
+    '''
+    variables = list(columns) + list(targets)
+    period_codes, periods = pd.factorize(input_.period, sort = True)
+    state_codes, states = pd.factorize(input_.state)
+    
+    values = np.full((len(periods), len(states), len(variables)), np.nan)
+    values[period_codes, state_codes] = input_[variables].to_numpy(dtype = float)
+    
+    #(window, state, variable) blocks for every window, flattened to (window, row, variable)
+    starts = np.arange(len(periods) - window + 1)
+    blocks = values[starts[:, None] + np.arange(window)]
+    blocks = blocks.reshape(len(starts), window * len(states), len(variables))
+    
+    valid = ~np.isnan(blocks).any(axis = 2)
+    counts = valid.sum(axis = 1)
+    blocks = np.where(valid[:, :, None], blocks, 0)
+    
+    means = blocks.sum(axis = 1) / np.maximum(counts, 1)[:, None]
+    centered = (blocks - means[:, None, :]) * valid[:, :, None]
+    cov = np.einsum('wri,wrj->wij', centered, centered)
+    std = np.sqrt(np.diagonal(cov, axis1 = 1, axis2 = 2))
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        corr = cov / (std[:, :, None] * std[:, None, :])
+    corr[counts < 3] = np.nan
+    
+    #keep the column by target block, in long form
+    corr = corr[:, :len(columns), len(columns):]
+    (w, c, t) = np.meshgrid(starts, np.arange(len(columns)), np.arange(len(targets)), indexing = 'ij')
+    
+    return pd.DataFrame({'period': np.asarray(periods)[w.ravel() + window - 1],
+                         'rows': counts[w.ravel()],
+                         'column': np.asarray(columns)[c.ravel()],
+                         'target': np.asarray(targets)[t.ravel()],
+                         'correlation': corr.ravel()})
+
+
+def get_store_path(csv_file):
+    '''
+    Returns the path of the columnar store that mirrors a dataset csv file.
+    Ex: 'all_colony_data.csv' returns 'all_colony_data.store'
+    '''
+    return splitext(csv_file)[0] + '.store'
+
+
+def write_frame_store(input_, path_, source_file = None):
+    '''
+    Writes a dataframe as a columnar store: a directory holding one .npy file per
+    column and a schema.json describing the columns. String columns are encoded
+    as categoricals, storing the integer codes and the list of categories, so the
+    store can be loaded without parsing or re-deriving any dtype.
+    
+    Rewriting a store never touches the files of the previous write, which running
+    processes may have memory mapped: every write stores its columns in new files,
+    named after a generation token, and switches to them by replacing schema.json.
+    The files of the write before the previous one are then removed, which leaves
+    the previous files to readers that read the old schema.json just before.
+    
+    input parameters:
+        input_: Dataframe to be written
+        path_: directory of the store
+        source_file: Optional csv file the store mirrors. Its size and modification
+                     time are recorded so load_dataset can detect a stale store.
+    '''
+    os.makedirs(path_, exist_ok = True)
+    previous = None
+    if isfile(join(path_, 'schema.json')):
+        with open(join(path_, 'schema.json')) as f:
+            previous = json.load(f).get('generation')
+    generation = os.urandom(4).hex()
+    schema = {'columns': [], 'source': None, 'generation': generation}
+    
+    for name in input_.columns:
+        column = input_[name]
+        file_ = '{}.{}.npy'.format(name, generation)
+        if column.dtype == object or is_categorical_dtype(column.dtype):
+            column = column.astype('category')
+            np.save(join(path_, file_), column.cat.codes.to_numpy())
+            schema['columns'].append({'name': name, 'file': file_,
+                                      'categories': [str(i) for i in column.cat.categories]})
+        else:
+            np.save(join(path_, file_), column.to_numpy())
+            schema['columns'].append({'name': name, 'file': file_})
+    
+    if source_file is not None:
+        stat_ = os.stat(source_file)
+        schema['source'] = {'mtime': stat_.st_mtime, 'size': stat_.st_size}
+    
+    #the schema is written last, so a store without one is never read
+    with open(join(path_, 'schema.json.tmp'), 'w') as f:
+        json.dump(schema, f, indent = 1)
+    os.replace(join(path_, 'schema.json.tmp'), join(path_, 'schema.json'))
+    
+    #unlinking a file does not affect the processes that have it mapped
+    for file_ in listdir(path_):
+        if file_.endswith('.npy') and file_.split('.')[-2] not in (generation, previous):
+            os.remove(join(path_, file_))
+
+
+def read_frame_store(path_, mmap = True):
+    '''
+    Reads a columnar store written by write_frame_store.
+    
+    input parameters:
+        path_: directory of the store
+        mmap: When True the column arrays are memory mapped read only instead of
+              being read into memory
+    
+    returns:
+        output_: Dataframe with categorical columns for the encoded string columns
+    '''
+    with open(join(path_, 'schema.json')) as f:
+        schema = json.load(f)
+    
+    columns = {}
+    for column in schema['columns']:
+        values = np.load(join(path_, column.get('file', column['name'] + '.npy')), mmap_mode = 'r' if mmap else None)
+        if 'categories' in column:
+            values = pd.Categorical.from_codes(values, column['categories'])
+        columns[column['name']] = values
+    
+    return pd.DataFrame(columns, copy = False)
+
+
+def build_frame_store(csv_file, schema = None):
+    '''
+    Writes the columnar store for a dataset csv file, see write_frame_store. When
+    a schema is given the columns are stored with its dtypes, see apply_schema.
+    '''
+    input_ = pd.read_csv(csv_file)
+    if schema is not None:
+        input_ = apply_schema(input_, schema)
+    write_frame_store(input_, get_store_path(csv_file), source_file = csv_file)
+
+
+def load_dataset(csv_file, mmap = True, schema = None):
+    '''
+    Loads a dataset from its columnar store when one exists and is up to date with
+    the csv file, falling back to reading the csv file otherwise.
+    
+    input parameters:
+        csv_file: path to the dataset csv file. Ex: 'all_colony_data.csv'
+        mmap: Memory map the store columns, see read_frame_store
+        schema: Optional dictionary of column dtypes the dataset is cast to, see apply_schema
+    
+    returns:
+        A dataframe with the dataset
+    '''
+    store_path = get_store_path(csv_file)
+    schema_file = join(store_path, 'schema.json')
+    
+    if isfile(schema_file):
+        with open(schema_file) as f:
+            source = json.load(f).get('source')
+        stat_ = os.stat(csv_file) if isfile(csv_file) else None
+        if stat_ is None or source == {'mtime': stat_.st_mtime, 'size': stat_.st_size}:
+            output_ = read_frame_store(store_path, mmap)
+            return output_ if schema is None else apply_schema(output_, schema)
+    
+    output_ = pd.read_csv(csv_file)
+    return output_ if schema is None else apply_schema(output_, schema)
+
+
+def index_by(input_, column):
+    '''
+    Splits a dataframe into a dictionary of slices keyed by the values of a column,
+    so a callback can get the rows for one period or one state with a dictionary
+    lookup instead of scanning the whole frame.
+    
+    input parameters:
+        input_: A dataframe. Ex: colony_data
+        column: Name of the column to index by. Ex: 'period'
+    
+    returns:
+        A dictionary mapping each value of column to the dataframe of its rows,
+        in their original order
+    '''
+    return {key: group for (key, group) in input_.groupby(column, sort = False, observed = True)}
+
+
+def select_rows(input_, column, value):
+    '''
+    Returns the rows of input_ where column equals value.
+    
+    input parameters:
+        input_: Either a dataframe or a dictionary built by index_by on the same column
+        column: Name of the column to select on
+        value: The value to select
+    
+    returns:
+        A dataframe with the selected rows
+    '''
+    if isinstance(input_, dict):
+        if value in input_:
+            return input_[value]
+        return next(iter(input_.values())).iloc[0:0]
+    
+    return input_[input_[column] == value]
+
+
+def widen_floats(input_):
+    '''
+    Returns input_ with its float32 columns converted to float64 through their
+    shortest decimal representation, so 26.9 stored as float32 becomes 26.9 and not
+    26.899999618530273. Figures built from the float32 datasets then carry the
+    same values as figures built from the csv files. Apply it once to the slices
+    built by index_by rather than to every selection.
+    '''
+    columns = {i: input_[i].to_numpy().astype(str).astype(np.float64)
+               for i in input_.columns if input_[i].dtype == np.float32}
+    if not columns:
+        return input_
+    return pd.DataFrame({i: columns.get(i, input_[i]) for i in input_.columns}, index = input_.index)
+
 
 def generate_map_object(input_, period_, category_):
     '''
     Returns a plotly chloropleth graph object
 
     input: 
-        input_: A dataframe of honey_data containing
-        relevant production data
+        input_: A dataframe of colony_data, or a dictionary of its
+        slices built with index_by(colony_data, 'period')
         
         period_: A string value containing the year and quarter of 
                  the data to be displayed. Ex: '2015Q1'
@@ -342,7 +1143,7 @@ def generate_map_object(input_, period_, category_):
 
     ''' 
     
-    df = input_[input_['period'] == period_]
+    df = select_rows(input_, 'period', period_)
     
     stressor_keys = {'varroa_mites': "Varroa Mites",
                  'pesticides': "Pesticides",
@@ -382,12 +1183,60 @@ def generate_map_object(input_, period_, category_):
     return fig
 
 
+def generate_production_map(input_, year_, zmax_ = None):
+    '''
+    Returns a plotly chloropleth graph object of honey production per state
+
+    input: 
+        input_: A dataframe of honey_data, or a dictionary of its
+        slices built with index_by(honey_data, 'year')
+        
+        year_: The year of the data to be displayed
+        
+        zmax_: Upper bound of the color scale. Passing the maximum over all
+               years keeps the colors comparable from one year to the next.
+
+    returns:
+        fig: A chloropleth graph object
+    '''
+    df = select_rows(input_, 'year', year_)
+    text_ = [str(i) + '<br>Colonies: {}k<br>Yield per colony: {} lbs'.format(j, k)
+             for (i, j, k) in zip(df.state, df.honey_colonies, df.yield_per_col)]
+    
+    fig = go.Figure(data=go.Choropleth(
+        locations=df.state_code,
+        z=df.production,
+        zmin = 0,
+        zmax = zmax_,
+        locationmode='USA-states',
+        colorscale='YlOrBr',
+        autocolorscale=False,
+        text=text_, # hover text
+        marker_line_color='white', # line markers between states
+        colorbar_title="1,000 lbs",
+    ))
+
+    fig.update_layout(
+        height=700,
+        width=1100,
+        title_text= 'Honey Production Per State In ' + str(year_) + '<br>(Hover for breakdown)',
+        geo = dict(
+            scope='usa',
+            projection=go.layout.geo.Projection(type = 'albers usa'),
+            showlakes=True, # lakes
+            lakecolor='rgb(255, 255, 255)'),
+    )
+    
+    return fig
+
+
 def generate_line_plot(input_, col_names, state_):
     '''
     Returns a multiline graph object of stressors for a specfic US state.
     
     input parameters:
-        input_: DataFrame containing data
+        input_: DataFrame containing data, or a dictionary of its slices
+                built with index_by(colony_data, 'state')
         col_names: Names of lines to be traced
         state_: Name of US State the
     
@@ -397,10 +1246,11 @@ def generate_line_plot(input_, col_names, state_):
     annotations = []
     colors = ['crimson', 'LightSkyBlue', "MediumPurple", "green", "orange", "yellowgreen", "brown"]
     color_ix = 0
+    df = select_rows(input_, 'state', state_)
+    x_ = list(df.period)
     for i in col_names:
         
-        x_=list(input_[input_.state == state_].period)
-        y_=list(input_[input_.state == state_][i])
+        y_=list(df[i])
 
         line_size = 4
         mode_size = 12
@@ -491,29 +1341,64 @@ def generate_line_plot(input_, col_names, state_):
     return fig
 
 
-def generate_bubble_chart(input_, year_, n):
+def generate_bubble_chart(input_, year_, n, mode = 'grouped'):
+    '''
+    Returns a bubble chart of the top n honey producing states in a year,
+    sized by their number of colonies.
+    
+    input parameters:
+        input_: A dataframe of honey_data, or a dictionary of its
+                slices built with index_by(honey_data, 'year')
+        year_: The year to be displayed
+        n: Number of states to be displayed
+        mode: 'grouped' draws one trace per state, which gives every state an
+              entry in the legend. 'single' draws all states as one trace with
+              per point sizes, colors and hover text, which makes a much smaller
+              figure but has no legend.
+    
+    returns:
+        fig: A scatter graph object
+    '''
     fig = go.Figure()
-    w_ = input_[input_.year==year_].sort_values(by='honey_colonies', ascending = False).head(n).state
-    x_=input_[input_.year==year_].sort_values(by='honey_colonies', ascending = False).head(n).avg_price_per_lb
-    x_ = x_/100
-    y_=input_[input_.year==year_].sort_values(by='honey_colonies', ascending = False).head(n).yield_per_col
-    z_ = input_[input_.year==year_].sort_values(by='honey_colonies', ascending = False).head(n).honey_colonies
+    top_ = select_rows(input_, 'year', year_).sort_values(by='honey_colonies', ascending = False).head(n)
+    w_ = [str(i) for i in top_.state]
+    x_ = top_.avg_price_per_lb/100
+    y_ = top_.yield_per_col
+    z_ = top_.honey_colonies
+    text_ = [q + '<br>' + 'No. of Colonies: {}'.format(k) + 'k' for q,k in zip(w_,z_)]
     
     annotations = []
-    for q,i,j,k in zip(w_,x_,y_,z_):
+    if mode == 'single':
+        #cycle through the template colors the same way separate traces would
+        colorway = plotly.colors.qualitative.Plotly
         fig.add_trace(go.Scatter(
-            x= [i],
-            y= [j],
-            name = str(q),
+            x = x_,
+            y = y_,
             mode='markers',
             marker=dict(
                 opacity=0.6,
-                size=[int(k)/5],
+                size=z_.astype(int)/5,
+                color=[colorway[i % len(colorway)] for i in range(len(w_))],
             ),
-            showlegend = True,
-            text = q + '<br>' + 'No. of Colonies: {}'.format(k) + 'k',
+            showlegend = False,
+            text = text_,
             textposition = 'top center'
         ))
+    else:
+        for q,i,j,k,t in zip(w_,x_,y_,z_,text_):
+            fig.add_trace(go.Scatter(
+                x= [i],
+                y= [j],
+                name = q,
+                mode='markers',
+                marker=dict(
+                    opacity=0.6,
+                    size=[int(k)/5],
+                ),
+                showlegend = True,
+                text = t,
+                textposition = 'top center'
+            ))
         
      # Title
     annotations.append(dict(xref='paper', yref='paper', x=0.0, y=1.05,
@@ -538,3 +1423,150 @@ def generate_bubble_chart(input_, year_, n):
                      plot_bgcolor = 'white')
     
     return fig
+
+
+
+def animation_controls(frame_names, prefix_, redraw = True):
+    '''
+    Returns the slider and play/pause buttons that step through the frames of an
+    animated figure in the browser.
+    
+    input parameters:
+        frame_names: Names of the frames, also used as the slider labels
+        prefix_: Text shown before the current slider label. Ex: 'Year: '
+        redraw: Whether each frame redraws the plot. Required for geo traces,
+                which do not support transitions.
+    
+    returns:
+        (sliders, updatemenus): Values for the figure layout
+    '''
+    frame_args = {'mode': 'immediate', 'frame': {'duration': 0, 'redraw': redraw}, 'transition': {'duration': 0}}
+    play_args = {'frame': {'duration': 700, 'redraw': redraw}, 'fromcurrent': True, 'transition': {'duration': 300}}
+    
+    sliders = [dict(
+        active = 0,
+        currentvalue = dict(prefix = prefix_),
+        pad = dict(t = 50),
+        steps = [dict(method = 'animate', label = str(i), args = [[str(i)], frame_args]) for i in frame_names],
+    )]
+    updatemenus = [dict(
+        type = 'buttons',
+        direction = 'left',
+        showactive = False,
+        x = 0.1, y = 0, xanchor = 'right', yanchor = 'top',
+        pad = dict(r = 10, t = 60),
+        buttons = [dict(label = 'Play', method = 'animate', args = [None, play_args]),
+                   dict(label = 'Pause', method = 'animate', args = [[None], frame_args])],
+    )]
+    
+    return (sliders, updatemenus)
+
+
+def generate_map_animation(input_, periods_, category_):
+    '''
+    Returns a choropleth with one animation frame per period, so the browser can
+    step through every period of a stressor without requesting a new figure.
+    The geo layout and colorbar are shared; each frame only carries the state
+    values, hover text and title of its period.
+    
+    input parameters:
+        input_: A dataframe of colony_data, or a dictionary of its
+                slices built with index_by(colony_data, 'period')
+        periods_: List of periods in animation order. Ex: ['2015Q1', '2015Q2']
+        category_: The variable to be used for density on the map, see generate_map_object
+    
+    returns:
+        fig: A chloropleth graph object with frames
+    '''
+    fig = generate_map_object(input_, periods_[0], category_)
+    title_ = fig.layout.title.text.replace(str(periods_[0]), '{}')
+    
+    frames = []
+    for i in periods_:
+        df = select_rows(input_, 'period', i)
+        frames.append(go.Frame(
+            name = str(i),
+            data = [go.Choropleth(locations = df.state_code, z = df[category_], text = df.state)],
+            layout = dict(title_text = title_.format(i)),
+        ))
+    
+    (sliders, updatemenus) = animation_controls(periods_, 'Period: ')
+    fig.update(frames = frames)
+    fig.update_layout(sliders = sliders, updatemenus = updatemenus)
+    
+    return fig
+
+
+def generate_bubble_animation(input_, years_, n):
+    '''
+    Returns a single trace bubble chart with one animation frame per year, so the
+    browser can step through every year without requesting a new figure.
+    Each frame carries the top n states of its year, its title and the axis
+    ranges for that year, since prices spread out considerably over time.
+    
+    input parameters:
+        input_: A dataframe of honey_data, or a dictionary of its
+                slices built with index_by(honey_data, 'year')
+        years_: List of years in animation order
+        n: Number of states to be displayed
+    
+    returns:
+        fig: A scatter graph object with frames
+    '''
+    charts = [generate_bubble_chart(input_, i, n, mode = 'single') for i in years_]
+    
+    frames = []
+    for (year_, chart) in zip(years_, charts):
+        x_ = np.asarray(chart.data[0].x, dtype = float)
+        y_ = np.asarray(chart.data[0].y, dtype = float)
+        x_pad = (np.nanmax(x_) - np.nanmin(x_)) * 0.15 or 0.1
+        y_pad = (np.nanmax(y_) - np.nanmin(y_)) * 0.15 or 5
+        frames.append(go.Frame(
+            name = str(year_),
+            data = chart.data,
+            layout = dict(annotations = chart.layout.annotations,
+                          xaxis = dict(range = [np.nanmin(x_) - x_pad, np.nanmax(x_) + x_pad]),
+                          yaxis = dict(range = [np.nanmin(y_) - y_pad, np.nanmax(y_) + y_pad])),
+        ))
+    
+    fig = go.Figure(data = charts[0].data, layout = charts[0].layout)
+    (sliders, updatemenus) = animation_controls(years_, 'Year: ', redraw = False)
+    fig.update(frames = frames)
+    fig.update_layout(sliders = sliders, updatemenus = updatemenus,
+                      xaxis = frames[0].layout.xaxis, yaxis = frames[0].layout.yaxis)
+    
+    return fig
+
+if __name__ == '__main__':
+    import argparse
+    
+    parser = argparse.ArgumentParser(description = 'Rebuilds the all_*.csv datasets, along with their columnar stores, '
+                                                   'from the USDA releases')
+    parser.add_argument('--workers', type = int, default = None,
+                        help = 'number of worker processes used for cleaning (default: one per CPU)')
+    parser.add_argument('--full', action = 'store_true',
+                        help = 'clean every release instead of only the new or changed ones')
+    parser.add_argument('--archives', action = 'store_true',
+                        help = 'read the releases straight from the zip archives in honey_colony_data and '
+                               'honey_production_data instead of colony_data and production_data')
+    args = parser.parse_args()
+    
+    cache_dir = None if args.full else INGEST_CACHE_PATH
+    if args.archives:
+        honey_prod, colony_data = get_data(workers = args.workers, colony_path = COLONY_ARCHIVE_PATH,
+                                           production_path = PRODUCTION_ARCHIVE_PATH, cache_dir = cache_dir)
+    else:
+        honey_prod, colony_data = get_data(workers = args.workers, cache_dir = cache_dir)
+    pesticide_data = aggregate_pesticide_data(clean_pesticide_data(PESTICIDE_PATH))
+    joined_data = join_colony_production(colony_data, honey_prod)
+    correlations = rolling_correlations(joined_data, CORRELATION_COLUMNS, CORRELATION_TARGETS)
+    
+    for (frame, name, schema) in [(honey_prod, 'all_honey_data.csv', HONEY_SCHEMA),
+                                  (colony_data, 'all_colony_data.csv', COLONY_SCHEMA),
+                                  (pesticide_data, 'all_pesticide_data.csv', None),
+                                  (joined_data, 'all_colony_production_data.csv', None),
+                                  (correlations, 'all_stressor_correlations.csv', None)]:
+        #write the csv files atomically so a reloading dashboard never reads one half written
+        frame.to_csv(join(DATA_DIR, name + '.tmp'), index = False)
+        os.replace(join(DATA_DIR, name + '.tmp'), join(DATA_DIR, name))
+        build_frame_store(join(DATA_DIR, name), schema)
@@ -5,293 +5,560 @@ import plotly.graph_objects as go
 import dash_daq as daq
 
 from clean_honey_data import *
+from figure_cache import FigureCache, FigurePrefetcher, ResponseCache, build_figure_store, install_response_layer
+from callback_metrics import CallbackMetrics, install_metrics
+from dash.dependencies import ClientsideFunction, Input, Output, State
 import pandas as pd
+import flask
+import threading
+import signal
+import os
+from functools import partial
 
 external_stylesheets_ = ['https://codepen.io/amyoshino/pen/jzXypZ.css']
 
 
 
-honey_data = pd.read_csv('all_honey_data.csv')
-
-colony_data = pd.read_csv('all_colony_data.csv')
-period_vals = list(colony_data.period.unique())
-slider_markers = {i+1: period_vals[i] for i in range(len(period_vals))}
 stressors = ["varroa_mites", "other_pests", "other", "pesticides", "unknown", "diseases", "lost_perc"]
+map_stressors = ["varroa_mites", "pesticides", "other_pests", "unknown", "diseases", "other"]
+#'grouped' keeps one legend entry per state, 'single' draws the bubbles as one trace
+bubble_chart_mode = os.environ.get('BUBBLE_CHART_MODE', 'grouped')
 state_dropdown = get_state_dropdown()
 state_names = get_state_names()
 
-app = dash.Dash(__name__, external_stylesheets = external_stylesheets_)
+#Every cached figure is keyed by the data version first, so a reload never serves stale figures
+#Serialized choropleth figures keyed by (data version, stressor, period), sized to hold every
+#combination once the periods are known
+map_figure_cache = FigureCache()
+#Serialized line plots keyed by (data version, state), rendered for every state by warm()
+line_figure_cache = FigureCache()
+warm_up_workers = int(os.environ.get('WARM_UP_WORKERS', os.cpu_count() or 1))
+#Serialized bubble charts keyed by (data version, year), sized to hold every year once they are known
+bubble_figure_cache = FigureCache()
+
+#Speculative prefetch: after a map or bubble chart request, the figures of the neighbouring
+#slider positions are built in PREFETCH_WORKERS background threads, with at most
+#PREFETCH_MAX_PENDING of them queued or running. Set PREFETCH_WORKERS=0 to turn off
+figure_prefetcher = FigurePrefetcher(workers = int(os.environ.get('PREFETCH_WORKERS', '2')),
+                                     max_pending = int(os.environ.get('PREFETCH_MAX_PENDING', '8')))
+
+#Animated mode: the map and bubble chart are served once as figures with one frame per
+#period or year, and the browser steps through them with the figure's own slider
+animated_figures = bool(os.environ.get('ANIMATED_FIGURES'))
+slider_style = {'display': 'none'} if animated_figures else {}
+animation_cache = FigureCache()
+
+#Clientside mode: the map and bubble chart figures ship once to the browser in dcc.Store
+#components and the slider callbacks run in the browser (assets/clientside.js)
+clientside_callbacks = bool(os.environ.get('CLIENTSIDE_CALLBACKS')) and not animated_figures
+
+#The datasets and everything derived from them, set by load_data and replaced as a whole by reload_data
+dashboard_data = None
+dashboard_data_lock = threading.Lock()
+
+#Hot reload: the data files are checked when a process starts serving, every DATA_RELOAD_INTERVAL
+#seconds (0 turns the polling off), and right away when the process gets DATA_RELOAD_SIGNAL, see
+#watch_data. Under gunicorn the signal has to be sent to the workers (Ex: pkill -USR2 -f 'gunicorn: worker'),
+#not to the master, where SIGUSR2 starts a binary upgrade
+data_reload_interval = float(os.environ.get('DATA_RELOAD_INTERVAL', '30'))
+data_reload_signal = os.environ.get('DATA_RELOAD_SIGNAL', 'SIGUSR2')
+data_reload_requested = threading.Event()
+data_reload_lock = threading.Lock()
+data_watcher_pid = None
+data_watcher_lock = threading.Lock()
+
+
+def get_data_files():
+    return [join(DATA_DIR, 'all_honey_data.csv'), join(DATA_DIR, 'all_colony_data.csv')]
+
+
+def read_data(version):
+    '''
+    Loads honey_data and colony_data and builds the values derived from them.
+
+    input parameters:
+        version: The data version of the files, see get_data_version
+
+    returns:
+        data: A dictionary with the data version, the datasets, the slider values and
+              the per period, state and year slices used by the callbacks
+    '''
+    #Load the typed columnar stores written by the cleaning pipeline, or the csv files when there are none,
+    #with the float32, int16 and categorical columns of the dataset schemas
+    honey_data = load_dataset(join(DATA_DIR, 'all_honey_data.csv'), schema = HONEY_SCHEMA)
+    colony_data = load_dataset(join(DATA_DIR, 'all_colony_data.csv'), schema = COLONY_SCHEMA)
+    period_vals = list(colony_data.period.unique())
+    data = {'version': version,
+            'honey_data': honey_data,
+            'colony_data': colony_data,
+            'period_vals': period_vals,
+            'slider_markers': {i+1: period_vals[i] for i in range(len(period_vals))},
+            'bubble_years': sorted(int(i) for i in honey_data.year.unique()),
+            #colony_data slices for the map and line plot callbacks, with their float32 columns
+            #widened once here so the figures carry the csv values
+            'colony_by_period': {i: widen_floats(j) for (i, j) in index_by(colony_data, 'period').items()},
+            'colony_by_state': {i: widen_floats(j) for (i, j) in index_by(colony_data, 'state').items()},
+            'honey_by_year': {i: widen_floats(j) for (i, j) in index_by(honey_data, 'year').items()}}
+
+    if clientside_callbacks:
+        data['map_figure_store'] = build_figure_store({i + '|' + str(j): generate_map_object(data['colony_by_period'], data['slider_markers'][j], i)
+                                                       for i in map_stressors for j in data['slider_markers']})
+        data['bubble_figure_store'] = build_figure_store({str(i): generate_bubble_chart(data['honey_by_year'], i, 15, mode = bubble_chart_mode)
+                                                          for i in data['bubble_years']})
+    return data
+
+
+def load_data():
+    '''
+    Returns the current data, loading it the first time it is called. Importing the
+    dashboard does not touch the data, it is loaded by the first page or callback
+    request, or ahead of time by warm(). A callback should call it once and use the
+    returned dictionary throughout, so it sees a single data version even when the
+    data is reloaded in the meantime.
+
+    returns:
+        data: The dictionary built by read_data
+    '''
+    with dashboard_data_lock:
+        if dashboard_data is None:
+            set_data(read_data(get_data_version(get_data_files())))
+        return dashboard_data
+
+
+def set_data(data):
+    global dashboard_data
+    dashboard_data = data
+    map_figure_cache.maxsize = len(map_stressors) * len(data['period_vals'])
+    bubble_figure_cache.maxsize = len(data['bubble_years'])
+
+
+def reload_data():
+    '''
+    Reloads the data when the content of the data files changed since it was loaded.
+    The new data replaces the old one as a whole, the figures cached for the old
+    version are dropped and the line plots of the new version are rendered.
+    Concurrent reloads, Ex: a poll and a signal, run one after the other, so the
+    later one finds the data up to date.
+
+    returns:
+        True when the data was reloaded
+    '''
+    with data_reload_lock:
+        version = get_data_version(get_data_files())
+        if dashboard_data is not None and dashboard_data['version'] == version:
+            return False
+
+        #the requests keep being served from the old data while the new one loads
+        data = read_data(version)
+        with dashboard_data_lock:
+            set_data(data)
+
+        for cache in [map_figure_cache, line_figure_cache, bubble_figure_cache, animation_cache, response_cache]:
+            cache.clear()
+        #no worker processes, this runs in a thread of a process serving requests
+        warm(workers = 1)
+        return True
+
+
+def try_reload_data():
+    '''
+    Calls reload_data, logging the error and keeping the current data when the
+    reload fails, Ex: on a data file that is being rewritten.
+
+    returns:
+        True when the data was reloaded
+    '''
+    try:
+        return reload_data()
+    except Exception:
+        server.logger.exception('Reloading the data failed, keeping the current data')
+        return False
+
+
+def watch_data():
+    '''
+    Starts the thread reloading the data of this process when its files change or
+    when the process gets DATA_RELOAD_SIGNAL. It is started by the first request of
+    every process, since threads do not survive the fork of the gunicorn workers.
+    That request first checks the data version, since a worker forked from the
+    preloaded master inherits the data the master loaded, which may be stale. The
+    requests arriving at the same time wait for that check.
+    '''
+    global data_watcher_pid
+    if data_watcher_pid == os.getpid():
+        return
+    with data_watcher_lock:
+        if data_watcher_pid == os.getpid():
+            return
+        if dashboard_data is not None:
+            try_reload_data()
+        data_watcher_pid = os.getpid()
+
+    def watch():
+        while True:
+            data_reload_requested.wait(data_reload_interval or None)
+            data_reload_requested.clear()
+            try_reload_data()
+
+    threading.Thread(target = watch, name = 'data-watcher', daemon = True).start()
+
+
+def install_reload_signal():
+    '''
+    Makes DATA_RELOAD_SIGNAL trigger a data reload. It has to be called from the main
+    thread, and in gunicorn after the worker has set up its own signal handlers.
+    '''
+    signal.signal(getattr(signal, data_reload_signal), lambda signum, frame: data_reload_requested.set())
+
+
+def warm(workers = warm_up_workers):
+    '''
+    Explicit warm up hook: loads the data and renders the line plot of every state,
+    in workers processes (WARM_UP_WORKERS, one per CPU by default), and when
+    WARM_FIGURE_CACHE is set, every map figure, so the first requests do not pay for
+    them. gunicorn.conf.py calls it in the master process when the app is preloaded.
+    '''
+    data = load_data()
+    line_figure_cache.warm([(data['version'], i) for i in data['colony_by_state']],
+                           partial(build_line_plot, colony_by_state = data['colony_by_state']),
+                           workers = workers)
+    if os.environ.get('WARM_FIGURE_CACHE'):
+        map_figure_cache.warm([(data['version'], i, j) for i in map_stressors for j in data['period_vals']],
+                              partial(build_map_object, colony_by_period = data['colony_by_period']))
+
+
+app = dash.Dash(__name__, external_stylesheets = external_stylesheets_, compress = True)
 server = app.server 
+
+#Per callback latency, payload and cache metrics served at /metrics. Set CALLBACK_METRICS=0
+#to turn off, and CALLBACK_PROFILE_DIR to dump a cProfile file for every callback request
+callback_metrics = CallbackMetrics(profile_dir = os.environ.get('CALLBACK_PROFILE_DIR'))
+if os.environ.get('CALLBACK_METRICS', '1') != '0':
+    install_metrics(server, callback_metrics)
+
+#Cached callback responses. Set CALLBACK_RESPONSE_CACHE=0 to turn off
+response_cache = ResponseCache()
+if os.environ.get('CALLBACK_RESPONSE_CACHE', '1') != '0':
+    install_response_layer(server, response_cache, version = lambda: load_data()['version'])
+
+server.before_request(watch_data)
+
+callback_metrics.add_cache('map_figures', map_figure_cache)
+callback_metrics.add_cache('line_figures', line_figure_cache)
+callback_metrics.add_cache('bubble_figures', bubble_figure_cache)
+callback_metrics.add_cache('animations', animation_cache)
+callback_metrics.add_cache('responses', response_cache)
+callback_metrics.add_prefetcher('figures', figure_prefetcher)
 app.title = "Honey Report"
-app.layout = html.Div(children=[
-    html.Div([
-        html.H1(children=['The Story of US Honey Bee Colonies']),
-        html.H2(children = 'by Edwin Ramirez'),
 
-        #paragraph
-        html.Div([
-        	html.P('In 2006 the US Environmental Protection Agency (EPA)' + \
-        		' reported the high emergence of colony collapse disorder (CCD)' + \
-        		' among bee populations throughout the United States. The large' + \
-        		' number of colonies dying had no single direct cause linked at the' + \
-        		' time even after several studies attempted to suggest' +\
-        		' that the cause could be global warming, pesticides, an unknown disease,'+ \
-        		' specific parasites, etc. With such a vital' + \
-        		' role in the ecosystem as pollinators and as producers of honey,' + \
-        		' the significance of bee preservation is not something to be ignored' + \
-        		' when the consequences affect the very food that is produced in farms across the United States. ' + \
-        		' The effects of CCD are not exclusive to the honey industry. Over ten years after the CCD epidemic began' + \
-        		' researchers discovered that neonicotinoid pesticides were killing off colony' + \
-        		' populations, and the EPA responded by banning all use of known harmful pesticides' + \
-        		' to honey bee populations. However, this single stressor' + \
-        		' can not be considered the one main cause to the CCD epidemic. Since 2006, the loss in' + \
-        		' populations has decreased over time, and scientists have been documenting' + \
-        		' the stressors that are now known to harm colonies,' + \
-        		' such as varroa mites, tracheal mites, starvation, weather conditions, diseases, pesticides, etc.' + \
-        		' In 2015, the USDA began documenting and publishing data recorded on the known stressors that currently' + \
-        		' harm honey bee populations today. The data is published annually with observations per state documented' + \
-        		' quarterly. Thus, the overall goal of this data exploration is to study how the currently known stressors affect regions of the United' + \
-        		' States today, and give greater insight on the story of how these stressors affect each state individually.'),
-        	
 
-        	html.P('Additionally, the United States Department of Agriculture (USDA) has been recording' +\
-        		' data on honey production per state since the 1970s. This data could be useful in analyzing the' + \
-        		' honey industry in the United States prior to the CCD outbreak and after' + \
-        		' (2000-2018). With the utilization of the USDA data that is recorded annually, a series of dynamic' + \
-        		' visualizations will be used to study where in the United States certain stressors have' + \
-        		' affected each region more than others. The first of these dynamic visualizations is the choropleth map' + \
-        		' below. The map contains two dynamic features that will alter the story told by the data: The dropdown menu' + \
-        		' (includes a specific stressor to be mapped), and the slider (the quarterly time period of the data to be mapped).' + \
-        		' The reasoning behind using a choropleth map is not to show progression over time, which would likely be shown on a standard line chart.' + \
-        		' However, visualizing fifty lines over time could get visually distracting, and be difficult to interpret. Thus, the purpose of this visual' + \
-        		' is to effectively illustrate the regions of the US during each individual quarter from 2015-2018. In fact, this visual is further supported' + \
-        		' with the second dynamic visualization, which also contains dynamic utilities, such as a dropdown menu. The visual is broken down into further detail below.')], 
-        className='six columns', 
-        style={'margin-top':"10%",
-        		'margin-bottom': '10%'}),
-
-        html.Div([], className = "six columns"),
-        
-        #Dropdown
-        html.Div(
-            children=[
-                dcc.Dropdown(
-                        id = 'dropdown1',
-                        options=[
-                            {'label': 'Varroa Mites', 'value': 'varroa_mites'},
-                            {'label': 'Pesticides', 'value': 'pesticides'},
-                            {'label': 'Other Pests (Tracheal Mites, Nosema, Wax Moths, etc)', 'value': 'other_pests'},
-                            {'label': 'Unknown', 'value': 'unknown'},
-                            {'label': 'Diseases', 'value': 'diseases'},
-                            {'label': 'Other Causes (Weather, Starvation, Queen Failure, etc)', 'value': 'other'}
-                        ],
-                        value='varroa_mites'
-                ),
-            ],
-            className='four columns',
-            style={'margin-right': '10%',
-            	   'display':'inline-block'}
-        ),
-
-        html.Div([], className = 'eight columns'),
-       
-        #map
-        html.Div(
-        	[
-        		dcc.Graph(
-		            id='us-map',
-	        )], 
-	        className = "six columns",
-	        style = {'margin-top': '1%'}),
-
-        html.Div([], className = "six columns"),
-
-        #slider
-        html.Div(
-                [
-                    daq.Slider(
-                        id = 'slider1',
-                  		min=1,
-                  		max=16,
-                        #marks={i: 'Label {}'.format(i) if i == 1 else str(i) for i in range(10, 41,5)},
-                        marks = slider_markers,
-                        value=1,
-                        size = 1000,
-                        handleLabel={"showCurrentValue":True, "label": "VALUE"}
+def serve_layout():
+    '''
+    Builds the page layout. The slider ranges and marks depend on the data, so the layout is
+    served by a function and the data is loaded by the first page request.
+    Dash also calls it once when it is assigned to app.layout, outside of any
+    request, only to collect the component ids, and that call gets the layout
+    without the data.
+    '''
+    data = load_data() if flask.has_request_context() else {}
+    slider_markers = data.get('slider_markers', {1: ''})
+    bubble_years = data.get('bubble_years', [2000])
+    layout = html.Div(children=[
+        html.Div([
+            html.H1(children=['The Story of US Honey Bee Colonies']),
+            html.H2(children = 'by Edwin Ramirez'),
+
+            #paragraph
+            html.Div([
+            	html.P('In 2006 the US Environmental Protection Agency (EPA)' + \
+            		' reported the high emergence of colony collapse disorder (CCD)' + \
+            		' among bee populations throughout the United States. The large' + \
+            		' number of colonies dying had no single direct cause linked at the' + \
+            		' time even after several studies attempted to suggest' +\
+            		' that the cause could be global warming, pesticides, an unknown disease,'+ \
+            		' specific parasites, etc. With such a vital' + \
+            		' role in the ecosystem as pollinators and as producers of honey,' + \
+            		' the significance of bee preservation is not something to be ignored' + \
+            		' when the consequences affect the very food that is produced in farms across the United States. ' + \
+            		' The effects of CCD are not exclusive to the honey industry. Over ten years after the CCD epidemic began' + \
+            		' researchers discovered that neonicotinoid pesticides were killing off colony' + \
+            		' populations, and the EPA responded by banning all use of known harmful pesticides' + \
+            		' to honey bee populations. However, this single stressor' + \
+            		' can not be considered the one main cause to the CCD epidemic. Since 2006, the loss in' + \
+            		' populations has decreased over time, and scientists have been documenting' + \
+            		' the stressors that are now known to harm colonies,' + \
+            		' such as varroa mites, tracheal mites, starvation, weather conditions, diseases, pesticides, etc.' + \
+            		' In 2015, the USDA began documenting and publishing data recorded on the known stressors that currently' + \
+            		' harm honey bee populations today. The data is published annually with observations per state documented' + \
+            		' quarterly. Thus, the overall goal of this data exploration is to study how the currently known stressors affect regions of the United' + \
+            		' States today, and give greater insight on the story of how these stressors affect each state individually.'),
+            	
+
+            	html.P('Additionally, the United States Department of Agriculture (USDA) has been recording' +\
+            		' data on honey production per state since the 1970s. This data could be useful in analyzing the' + \
+            		' honey industry in the United States prior to the CCD outbreak and after' + \
+            		' (2000-2018). With the utilization of the USDA data that is recorded annually, a series of dynamic' + \
+            		' visualizations will be used to study where in the United States certain stressors have' + \
+            		' affected each region more than others. The first of these dynamic visualizations is the choropleth map' + \
+            		' below. The map contains two dynamic features that will alter the story told by the data: The dropdown menu' + \
+            		' (includes a specific stressor to be mapped), and the slider (the quarterly time period of the data to be mapped).' + \
+            		' The reasoning behind using a choropleth map is not to show progression over time, which would likely be shown on a standard line chart.' + \
+            		' However, visualizing fifty lines over time could get visually distracting, and be difficult to interpret. Thus, the purpose of this visual' + \
+            		' is to effectively illustrate the regions of the US during each individual quarter from 2015-2018. In fact, this visual is further supported' + \
+            		' with the second dynamic visualization, which also contains dynamic utilities, such as a dropdown menu. The visual is broken down into further detail below.')], 
+            className='six columns', 
+            style={'margin-top':"10%",
+            		'margin-bottom': '10%'}),
+
+            html.Div([], className = "six columns"),
+            
+            #Dropdown
+            html.Div(
+                children=[
+                    dcc.Dropdown(
+                            id = 'dropdown1',
+                            options=[
+                                {'label': 'Varroa Mites', 'value': 'varroa_mites'},
+                                {'label': 'Pesticides', 'value': 'pesticides'},
+                                {'label': 'Other Pests (Tracheal Mites, Nosema, Wax Moths, etc)', 'value': 'other_pests'},
+                                {'label': 'Unknown', 'value': 'unknown'},
+                                {'label': 'Diseases', 'value': 'diseases'},
+                                {'label': 'Other Causes (Weather, Starvation, Queen Failure, etc)', 'value': 'other'}
+                            ],
+                            value='varroa_mites'
                     ),
                 ],
-                className='nine columns',
-                style={'margin-top': '3%',
-                		'margin-bottom:':'3%'}),
-
-        html.Div([], className = "three columns"),
-        
-        #paragraph
-        html.Div([
-        	html.P('The second dynamic visual is to be used in conjunction with the choropleth map displayed above. When analyzing a specific quarter and stressor on the choropleth map, ' +\
-        		   'the dynamic line chart can provide a deeper insight on showing the progression of all stressors from 2015-2018 for a specified state. Therefore, ' +\
-        		   'this visual succeeds at effectively illustrating which stressors are affecting each state over time, the percentage of colonies lost, and the max ' + \
-        		   'value for each stressor indicated by a marker. Thus, by using the choropleth map for specific quarters, a user can visually see which states may be interesting ' + \
-        		   'to view more in depth in the dynamic line plot.'),
-        	html.P('A few states that illustrate vastly different stories include California, Nebraska, Hawaii, Florida, and Kansas. Looking at California shows that Varroa Mites' + \
-        		   ' are the dominant stressor in this state, and that at times diseases and pesticide use follow the trends of the percentage of colonies that are lost. It can also' + \
-        		   ' be seen that pesticide use at times is effective at managing other pests and Varroa Mites, but not sufficiently enough in the case of the latter. Taking a look' + \
-        		   ' at Hawaii illustrates that percentage loss of colonies is relatively low, and that varroa mites and other pests follow seasonal trends. Unfortunately, this also' + \
-        		   ' shows that the lack of pesticide use in Hawaii is potentially the reason that 91 percent of populations are affected by pests, and that this' + \
-        		   ' could be the cause of the infestation from late 2017 to the end of 2018. However, there are no populations recorded to be affected by diseases.' +\
-        		   ' This is probably due to the isolation of the Hawaiian islands.')], 
-        className='six columns', 
-        style={'margin-top':"10%",
-        		#'margin-left': '10%',
-        		#'margin-right': '10%',
-        		}),
-
-
-
-
-        html.Div([], className='six columns'),
-
-        
-        #Dropdown 2
-        html.Div(
-            [
-                dcc.Dropdown(
-                        id = 'dropdown2',
-                        options=state_dropdown,
-                        value='California'
-                ),
-            ],
-            className='two columns',
-            #style = {'margin-left' : '10%',
-            		 #'margin-right': '10%'}
-            		 ),
-
-        html.Div([], className = "ten columns"),
-
-        #Line plot
-        html.Div(
-        	[
-	        	dcc.Graph(
-	        		id='state-line-plot'
-	        )], 
-	        className = "three columns",
-	        style = {'margin-right':'80%'}),
-	        		 #'margin-left' : '12%',
-	        		 #'margin-right': '10%',
-	        #		 'margin-bottom': '10%'}),
-
-        html.Div([], className = "nine columns"),
-
-
-
-        
-        #paragraph
-        html.Div([
-        	html.P('The third and final dynamic visualization is a bubble chart that switches focus to the market of the honey industry by analyzing the 15 top producing states' + \
-        		   ' from 2000-2018. This visual has one dynamic feature, which is the slider that indicates the year. Each bubble is representative of a state. The legend' + \
-        		   ' to the right illustrates the top 15 in order by number of colonies, where the top indicates the state with the largest population of honey bees.' + \
-        		   ' The population size is also reflected in the size of each bubble to provide a better visual comparison. The y-axis is the average honey yield per colony in pounds,' + \
-        		   ' while the x-axis is the average price per pound. This visual can ultimately show the transition of states in price, production, and population over 18 years of data.' +\
-        		   ' Finally, hovering over any of the bubbles triggers a tooltip popup that summarizes the information about the current observation. One aspect I found interesting' + \
-        		   ' was seeing the dramatic price difference per pound of honey in the states with smaller populations, such as New York in 2018. One story' + \
-        		   ' that is also interesting to follow is the population sizes of California and North Dakota. California used to be the state with the largest number of colonies' + \
-        		   ' until 2007. After 2007 the number of colonies in North Dakota dramatically increases. Additionally, if we look at the years prior to the start of the CCD epidemic' + \
-        		   ' we can see that most states were similar in price and yield per pound, such as in the years from 2000-2005, but in 2006 and after we see most of the top states scatter dramatically across the plot.' + \
-        		   ' In fact, pay close attention to the price range values on the x-axis as they dramatically change. In 2000 nearly all of the top states are within 15 cents of each other, and this is also seen in 2005 where'+\
-        		   ' they are within $0.10 of each other. By 2013, the top states are on a range that spans a $0.40 difference, and within a full dollar range in 2018. The price range in 2000 was from $0.52-0.68, and ends in a range from $1.80-$3.40 in 2018.' +\
-        		   ' One hypothesis that can be drawn from this visual is that the honey market may have indeed been affected by CCD. Perhaps the stressors that are now recorded by the USDA could have correlation to the changing price and honey yield values, but further analysis would be required to determine this by merging the colony and production datasets. This will be the main focus of the next blog. ')], 
-        className='six columns', 
-        style={'margin-top':"10%",
-        		#'margin-left': '10%',
-        		#'margin-right': '10%',
-        		}),
-
-
-
-
-        html.Div([], className='six columns'),
-
-      	
-
-    	
-    	#bubbble
-    	html.Div(
-        	[
-	        	dcc.Graph(
-	        		id='bubble-plot'
-	        )], 
-	        className = "six columns",
-	        style = {'margin-top':'3%',
-	        		 #'margin-left' : '10%',
-	        		 #'margin-right': '10%',
-	 	       		 'margin-bottom': '1%'}),
-    	#slider
-    	html.Div(
+                className='four columns',
+                style={'margin-right': '10%',
+                	   'display':'inline-block'}
+            ),
+
+            html.Div([], className = 'eight columns'),
+           
+            #map
+            html.Div(
+            	[
+            		dcc.Graph(
+    		            id='us-map',
+    	        )], 
+    	        className = "six columns",
+    	        style = {'margin-top': '1%'}),
+
+            html.Div([], className = "six columns"),
+
+            #slider
+            html.Div(
+                    [
+                        daq.Slider(
+                            id = 'slider1',
+                      		min=1,
+                      		max=max(slider_markers),
+                            #marks={i: 'Label {}'.format(i) if i == 1 else str(i) for i in range(10, 41,5)},
+                            marks = slider_markers,
+                            value=1,
+                            size = 1000,
+                            handleLabel={"showCurrentValue":True, "label": "VALUE"}
+                        ),
+                    ],
+                    className='nine columns',
+                    style=dict({'margin-top': '3%',
+                    		'margin-bottom:':'3%'}, **slider_style)),
+
+            html.Div([], className = "three columns"),
+            
+            #paragraph
+            html.Div([
+            	html.P('The second dynamic visual is to be used in conjunction with the choropleth map displayed above. When analyzing a specific quarter and stressor on the choropleth map, ' +\
+            		   'the dynamic line chart can provide a deeper insight on showing the progression of all stressors from 2015-2018 for a specified state. Therefore, ' +\
+            		   'this visual succeeds at effectively illustrating which stressors are affecting each state over time, the percentage of colonies lost, and the max ' + \
+            		   'value for each stressor indicated by a marker. Thus, by using the choropleth map for specific quarters, a user can visually see which states may be interesting ' + \
+            		   'to view more in depth in the dynamic line plot.'),
+            	html.P('A few states that illustrate vastly different stories include California, Nebraska, Hawaii, Florida, and Kansas. Looking at California shows that Varroa Mites' + \
+            		   ' are the dominant stressor in this state, and that at times diseases and pesticide use follow the trends of the percentage of colonies that are lost. It can also' + \
+            		   ' be seen that pesticide use at times is effective at managing other pests and Varroa Mites, but not sufficiently enough in the case of the latter. Taking a look' + \
+            		   ' at Hawaii illustrates that percentage loss of colonies is relatively low, and that varroa mites and other pests follow seasonal trends. Unfortunately, this also' + \
+            		   ' shows that the lack of pesticide use in Hawaii is potentially the reason that 91 percent of populations are affected by pests, and that this' + \
+            		   ' could be the cause of the infestation from late 2017 to the end of 2018. However, there are no populations recorded to be affected by diseases.' +\
+            		   ' This is probably due to the isolation of the Hawaiian islands.')], 
+            className='six columns', 
+            style={'margin-top':"10%",
+            		#'margin-left': '10%',
+            		#'margin-right': '10%',
+            		}),
+
+
+
+
+            html.Div([], className='six columns'),
+
+            
+            #Dropdown 2
+            html.Div(
                 [
-                    daq.Slider(
-                        id = 'slider2',
-                  		min=2000,
-                  		max=2018,
-                        marks={i: 'Label {}'.format(i) if i == 1 else str(i) for i in range(2000, 2019)},
-                        #marks = slider_markers,
-                        value=2000,
-                        size = 800,
-                        handleLabel={"showCurrentValue":True, "label": "VALUE"}
+                    dcc.Dropdown(
+                            id = 'dropdown2',
+                            options=state_dropdown,
+                            value='California'
                     ),
                 ],
-                className='six columns',
-                style = {'margin-top' : '3%', 'margin-left': '13%'}),
-            		 	 
-    	html.Div([], className="six columns"),
-
-
-    	#paragraph
-        html.Div([
-        	html.H2('References'),
-        	dcc.Markdown('''
-        		[Source Code]('https://github.com/edalrami/viz-storytelling')
-        		'''),
-        	dcc.Markdown('''
-        		[USDA Honey Production Data]('https://usda.library.cornell.edu/concern/publications/hd76s004z?locale=en&page=3#release-items')
-        		'''),
-
-        	dcc.Markdown('''
-        		[USDA Honey Bee Colony Data]('https://usda.library.cornell.edu/concern/publications/rn301137d?locale=en')
-        		'''),
-
-        	dcc.Markdown('''
-        		[National Pesticide Information Center]('http://npic.orst.edu/envir/ccd.html')
-        		'''),
+                className='two columns',
+                #style = {'margin-left' : '10%',
+                		 #'margin-right': '10%'}
+                		 ),
+
+            html.Div([], className = "ten columns"),
+
+            #Line plot
+            html.Div(
+            	[
+    	        	dcc.Graph(
+    	        		id='state-line-plot'
+    	        )], 
+    	        className = "three columns",
+    	        style = {'margin-right':'80%'}),
+    	        		 #'margin-left' : '12%',
+    	        		 #'margin-right': '10%',
+    	        #		 'margin-bottom': '10%'}),
+
+            html.Div([], className = "nine columns"),
+
+
+
+            
+            #paragraph
+            html.Div([
+            	html.P('The third and final dynamic visualization is a bubble chart that switches focus to the market of the honey industry by analyzing the 15 top producing states' + \
+            		   ' from 2000-2018. This visual has one dynamic feature, which is the slider that indicates the year. Each bubble is representative of a state. The legend' + \
+            		   ' to the right illustrates the top 15 in order by number of colonies, where the top indicates the state with the largest population of honey bees.' + \
+            		   ' The population size is also reflected in the size of each bubble to provide a better visual comparison. The y-axis is the average honey yield per colony in pounds,' + \
+            		   ' while the x-axis is the average price per pound. This visual can ultimately show the transition of states in price, production, and population over 18 years of data.' +\
+            		   ' Finally, hovering over any of the bubbles triggers a tooltip popup that summarizes the information about the current observation. One aspect I found interesting' + \
+            		   ' was seeing the dramatic price difference per pound of honey in the states with smaller populations, such as New York in 2018. One story' + \
+            		   ' that is also interesting to follow is the population sizes of California and North Dakota. California used to be the state with the largest number of colonies' + \
+            		   ' until 2007. After 2007 the number of colonies in North Dakota dramatically increases. Additionally, if we look at the years prior to the start of the CCD epidemic' + \
+            		   ' we can see that most states were similar in price and yield per pound, such as in the years from 2000-2005, but in 2006 and after we see most of the top states scatter dramatically across the plot.' + \
+            		   ' In fact, pay close attention to the price range values on the x-axis as they dramatically change. In 2000 nearly all of the top states are within 15 cents of each other, and this is also seen in 2005 where'+\
+            		   ' they are within $0.10 of each other. By 2013, the top states are on a range that spans a $0.40 difference, and within a full dollar range in 2018. The price range in 2000 was from $0.52-0.68, and ends in a range from $1.80-$3.40 in 2018.' +\
+            		   ' One hypothesis that can be drawn from this visual is that the honey market may have indeed been affected by CCD. Perhaps the stressors that are now recorded by the USDA could have correlation to the changing price and honey yield values, but further analysis would be required to determine this by merging the colony and production datasets. This will be the main focus of the next blog. ')], 
+            className='six columns', 
+            style={'margin-top':"10%",
+            		#'margin-left': '10%',
+            		#'margin-right': '10%',
+            		}),
+
+
+
+
+            html.Div([], className='six columns'),
+
+          	
 
+        	
+        	#bubbble
+        	html.Div(
+            	[
+    	        	dcc.Graph(
+    	        		id='bubble-plot'
+    	        )], 
+    	        className = "six columns",
+    	        style = {'margin-top':'3%',
+    	        		 #'margin-left' : '10%',
+    	        		 #'margin-right': '10%',
+    	 	       		 'margin-bottom': '1%'}),
+        	#slider
+        	html.Div(
+                    [
+                        daq.Slider(
+                            id = 'slider2',
+                      		min=bubble_years[0],
+                      		max=bubble_years[-1],
+                            marks={i: 'Label {}'.format(i) if i == 1 else str(i) for i in bubble_years},
+                            #marks = slider_markers,
+                            value=bubble_years[0],
+                            size = 800,
+                            handleLabel={"showCurrentValue":True, "label": "VALUE"}
+                        ),
+                    ],
+                    className='six columns',
+                    style = dict({'margin-top' : '3%', 'margin-left': '13%'}, **slider_style)),
+                		 	 
+        	html.Div([], className="six columns"),
+
+
+        	#paragraph
+            html.Div([
+            	html.H2('References'),
+            	dcc.Markdown('''
+            		[Source Code]('https://github.com/edalrami/viz-storytelling')
+            		'''),
+            	dcc.Markdown('''
+            		[USDA Honey Production Data]('https://usda.library.cornell.edu/concern/publications/hd76s004z?locale=en&page=3#release-items')
+            		'''),
+
+            	dcc.Markdown('''
+            		[USDA Honey Bee Colony Data]('https://usda.library.cornell.edu/concern/publications/rn301137d?locale=en')
+            		'''),
+
+            	dcc.Markdown('''
+            		[National Pesticide Information Center]('http://npic.orst.edu/envir/ccd.html')
+            		'''),
+
+
+            	], 
+            className='six columns', 
+            style={'margin-top':"10%",
+            		#'margin-left': '10%',
+            		#'margin-right': '10%',
+            		}),
+
+
+
+
+        ], 
+        className = "twelve columns",
+        style={'margin-top': '10%', 'margin-left':'10%'}),
+    ])
+
+    if clientside_callbacks:
+        layout.children += [dcc.Store(id = 'map-figure-store', data = data.get('map_figure_store')),
+                            dcc.Store(id = 'bubble-figure-store', data = data.get('bubble_figure_store'))]
+    return layout
+
+app.layout = serve_layout
 
-        	], 
-        className='six columns', 
-        style={'margin-top':"10%",
-        		#'margin-left': '10%',
-        		#'margin-right': '10%',
-        		}),
 
 
 
 
-    ], 
-    className = "twelve columns",
-    style={'margin-top': '10%', 'margin-left':'10%'}),
-])
+def update_map(dropdown_, slider_):
+	data = load_data()
+	if animated_figures:
+		return animation_cache.get((data['version'], 'map', dropdown_), lambda: generate_map_animation(data['colony_by_period'], data['period_vals'], dropdown_))
+	period_ = data['slider_markers'][slider_]
+	figure = map_figure_cache.get((data['version'], dropdown_, period_), lambda: generate_map_object(data['colony_by_period'], period_, dropdown_))
+	#the next request is most likely for a neighbouring period
+	figure_prefetcher.prefetch(map_figure_cache,
+	                           [(data['version'], dropdown_, data['slider_markers'][i]) for i in (slider_ + 1, slider_ - 1) if i in data['slider_markers']],
+	                           partial(build_map_object, colony_by_period = data['colony_by_period']))
+	return figure
 
 
+def build_map_object(key, colony_by_period):
+	'''
+	Builds the map of a (data version, stressor, period) key of map_figure_cache.
+	'''
+	return generate_map_object(colony_by_period, key[2], key[1])
 
-@app.callback(
-    dash.dependencies.Output('us-map', 'figure'),
-    [dash.dependencies.Input('dropdown1', 'value'), dash.dependencies.Input('slider1', 'value')])
-def update_map(dropdown_, slider_):
-	for i in stressors:
-		if i in dropdown_:
-		    title_ = "Top "+ str(slider_) + " Honey"
-		    fig = generate_map_object(colony_data, slider_markers[slider_], dropdown_)
-		    figure = fig
-	
-	return figure
+if clientside_callbacks:
+    app.clientside_callback(
+        ClientsideFunction(namespace = 'honey', function_name = 'update_figure'),
+        Output('us-map', 'figure'),
+        [Input('dropdown1', 'value'), Input('slider1', 'value')],
+        [State('map-figure-store', 'data')])
+else:
+    app.callback(
+        Output('us-map', 'figure'),
+        [Input('dropdown1', 'value'), Input('slider1', 'value')])(callback_metrics.instrument(update_map))
 
 
 
@@ -300,21 +567,55 @@ stressors2 = ["varroa_mites", "other_pests", "pesticides", "diseases", "lost_per
 @app.callback(
     dash.dependencies.Output('state-line-plot', 'figure'),
     [dash.dependencies.Input('dropdown2', 'value')])
+@callback_metrics.instrument
 def update_line_plot(dropdown_):
+	data = load_data()
 	for i in state_names:
 		if i in dropdown_:
-		    fig = generate_line_plot(colony_data, stressors2, dropdown_)
-		    figure = fig
+		    figure = line_figure_cache.get((data['version'], dropdown_),
+		                                   lambda: build_line_plot((data['version'], dropdown_), data['colony_by_state']))
 	
 	return figure
 
-@app.callback(
-    dash.dependencies.Output('bubble-plot', 'figure'),
-    [dash.dependencies.Input('slider2', 'value')])
+
+def build_line_plot(key, colony_by_state):
+	'''
+	Builds the line plot of a (data version, state) key of line_figure_cache.
+	'''
+	return generate_line_plot(colony_by_state, stressors2, key[1])
+
+
 def update_bubble_plot(slider_):
-	figure = generate_bubble_chart(honey_data, slider_, 15)
+	data = load_data()
+	if animated_figures:
+		return animation_cache.get((data['version'], 'bubble'), lambda: generate_bubble_animation(data['honey_by_year'], data['bubble_years'], 15))
+	figure = bubble_figure_cache.get((data['version'], slider_), lambda: build_bubble_chart((data['version'], slider_), data['honey_by_year']))
+	#the next request is most likely for a neighbouring year
+	figure_prefetcher.prefetch(bubble_figure_cache,
+	                           [(data['version'], i) for i in (slider_ + 1, slider_ - 1) if i in data['bubble_years']],
+	                           partial(build_bubble_chart, honey_by_year = data['honey_by_year']))
 	return figure
 
 
+def build_bubble_chart(key, honey_by_year):
+	'''
+	Builds the bubble chart of a (data version, year) key of bubble_figure_cache.
+	'''
+	return generate_bubble_chart(honey_by_year, key[1], 15, mode = bubble_chart_mode)
+
+if clientside_callbacks:
+    app.clientside_callback(
+        ClientsideFunction(namespace = 'honey', function_name = 'update_figure'),
+        Output('bubble-plot', 'figure'),
+        [Input('slider2', 'value')],
+        [State('bubble-figure-store', 'data')])
+else:
+    app.callback(
+        Output('bubble-plot', 'figure'),
+        [Input('slider2', 'value')])(callback_metrics.instrument(update_bubble_plot))
+
+
 if __name__ == '__main__':
+    warm()
+    install_reload_signal()
     app.run_server(debug=True)
\ No newline at end of file
@@ -0,0 +1,395 @@
+import json
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import repeat
+
+import flask
+
+
+class FigureCache:
+    '''
+    Thread safe LRU cache of serialized plotly figures.
+
+    Figures are stored as their compact JSON representation, with floats rounded
+    once when they are stored (see serialize_figure), so a cache hit only has to
+    parse the stored JSON back into a dictionary that Dash can return directly,
+    skipping the construction and validation of the plotly graph objects.
+
+    input parameters:
+        maxsize: Maximum number of figures kept in the cache. When None the
+                 cache is never evicted.
+        digits: Number of decimals the floats of the figures are rounded to
+    '''
+
+    def __init__(self, maxsize=None, digits = 6):
+        self.maxsize = maxsize
+        self.digits = digits
+        self.hits = 0
+        self.misses = 0
+        self.prefetch_hits = 0
+        self._figures = OrderedDict()
+        #keys stored by a FigurePrefetcher and not requested since
+        self._prefetched = set()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._figures)
+
+    def __contains__(self, key):
+        return key in self._figures
+
+    def get(self, key, build_figure):
+        '''
+        Returns the figure stored under key, building and storing it on a miss.
+
+        input parameters:
+            key: A hashable key identifying the figure. Ex: ('varroa_mites', '2015Q1')
+            build_figure: A function with no arguments that returns a plotly figure
+
+        returns:
+            figure: A dictionary representation of the figure
+        '''
+        start = time.perf_counter()
+        build_seconds = 0.0
+        with self._lock:
+            figure_json = self._figures.get(key)
+            if figure_json is not None:
+                self._figures.move_to_end(key)
+                self.hits += 1
+                if key in self._prefetched:
+                    self._prefetched.discard(key)
+                    self.prefetch_hits += 1
+            else:
+                self.misses += 1
+
+        if figure_json is None:
+            figure = build_figure()
+            build_seconds = time.perf_counter() - start
+            figure_json = serialize_figure(figure, self.digits)
+            self.put(key, figure_json)
+
+        figure = json.loads(figure_json)
+        record_figure_seconds(build_seconds, time.perf_counter() - start - build_seconds)
+        return figure
+
+    def put(self, key, figure_json, prefetched = False):
+        '''
+        Stores a serialized figure under key, evicting the least recently used
+        figure when the cache is full. A prefetched figure counts as a prefetch hit
+        the first time it is requested.
+        '''
+        with self._lock:
+            self._figures[key] = figure_json
+            self._figures.move_to_end(key)
+            if prefetched:
+                self._prefetched.add(key)
+            if self.maxsize is not None and len(self._figures) > self.maxsize:
+                self._prefetched.discard(self._figures.popitem(last=False)[0])
+
+    def warm(self, keys, build_figure, workers = 1):
+        '''
+        Builds and stores the figures for every key that is not cached yet.
+
+        input parameters:
+            keys: An iterable of keys
+            build_figure: A function taking a key and returning a plotly figure
+            workers: Number of worker processes building and serializing the figures.
+                     With more than one, build_figure and the keys must be picklable,
+                     Ex: a functools.partial of a module level function.
+        '''
+        keys = [key for key in keys if key not in self]
+        if workers > 1 and len(keys) > 1:
+            with ProcessPoolExecutor(workers) as pool:
+                chunksize = -(-len(keys) // workers)
+                figures = list(pool.map(build_figure_json, repeat(build_figure), keys, repeat(self.digits),
+                                        chunksize = chunksize))
+        else:
+            figures = (build_figure_json(build_figure, key, self.digits) for key in keys)
+
+        for (key, figure_json) in zip(keys, figures):
+            self.put(key, figure_json)
+
+    def clear(self):
+        with self._lock:
+            self._figures.clear()
+            self._prefetched.clear()
+
+    def stats(self):
+        '''
+        Returns a dictionary with the hit, miss and prefetch hit counters and the cache size.
+        '''
+        with self._lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'prefetch_hits': self.prefetch_hits,
+                    'size': len(self._figures),
+                    'maxsize': self.maxsize}
+
+
+class FigurePrefetcher:
+    '''
+    Builds figures speculatively in a pool of background threads and stores them
+    in a FigureCache, so a request for a figure that was prefetched is a cache hit.
+    The callbacks use it for the figures of the slider positions next to the one
+    just served, which are the most likely next requests while a slider is dragged.
+
+    The number of prefetches queued or running is bounded: a prefetch submitted
+    while max_pending are in flight is dropped, so a burst of requests never builds
+    up a backlog of figures that may not be wanted any more. The pool is started
+    by the first prefetch of every process, since threads do not survive the fork
+    of the gunicorn workers.
+
+    input parameters:
+        workers: Number of threads building the figures. 0 turns prefetching off.
+        max_pending: Maximum number of prefetches queued or running at once
+    '''
+
+    def __init__(self, workers = 2, max_pending = 8):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.scheduled = 0
+        self.dropped = 0
+        self.built = 0
+        self.errors = 0
+        self._pending = set()
+        self._pool = None
+        self._pool_pid = None
+        self._lock = threading.Lock()
+
+    def prefetch(self, cache, keys, build_figure):
+        '''
+        Schedules the figures of the keys that are neither cached nor already being
+        prefetched, without waiting for them.
+
+        input parameters:
+            cache: The FigureCache the figures are stored in
+            keys: An iterable of keys
+            build_figure: A function taking a key and returning a plotly figure
+        '''
+        if self.workers <= 0:
+            return
+        with self._lock:
+            if self._pool_pid != os.getpid():
+                self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix = 'figure-prefetch')
+                self._pool_pid = os.getpid()
+                self._pending = set()
+
+            for key in keys:
+                if key in cache or (id(cache), key) in self._pending:
+                    continue
+                if len(self._pending) >= self.max_pending:
+                    self.dropped += 1
+                    continue
+                self._pending.add((id(cache), key))
+                self.scheduled += 1
+                self._pool.submit(self._build, cache, key, build_figure)
+
+    def _build(self, cache, key, build_figure):
+        try:
+            if key not in cache:
+                cache.put(key, build_figure_json(build_figure, key, cache.digits), prefetched = True)
+            built, errors = 1, 0
+        except Exception:
+            #a failed prefetch only costs the request its cache hit
+            built, errors = 0, 1
+        with self._lock:
+            self._pending.discard((id(cache), key))
+            self.built += built
+            self.errors += errors
+
+    def stats(self):
+        '''
+        Returns a dictionary with the prefetch counters and the number of prefetches
+        queued or running.
+        '''
+        with self._lock:
+            return {'scheduled': self.scheduled,
+                    'dropped': self.dropped,
+                    'built': self.built,
+                    'errors': self.errors,
+                    'pending': len(self._pending)}
+
+
+def record_figure_seconds(build_seconds, serialization_seconds):
+    '''
+    Adds the time spent building a figure and the time spent serializing it and
+    parsing it back to the current request, as figure_build_seconds and
+    figure_serialization_seconds on flask.g, for CallbackMetrics. Outside of a
+    request, Ex: in a prefetch thread, nothing is recorded.
+    '''
+    if not flask.has_request_context():
+        return
+    flask.g.figure_build_seconds = flask.g.get('figure_build_seconds', 0.0) + build_seconds
+    flask.g.figure_serialization_seconds = flask.g.get('figure_serialization_seconds', 0.0) + serialization_seconds
+
+
+def build_figure_json(build_figure, key, digits = 6):
+    '''
+    Builds the figure for key and returns its JSON representation, see serialize_figure.
+    '''
+    return serialize_figure(build_figure(key), digits)
+
+
+def serialize_figure(figure, digits = 6):
+    '''
+    Returns a plotly figure as compact JSON bytes with every float rounded to a
+    number of decimals, see round_floats. It runs once per figure, when the figure
+    is stored in a FigureCache, so the responses serving it skip the rounding.
+    '''
+    return dumps(round_floats(json.loads(figure.to_json()), digits))
+
+
+def build_figure_store(figures):
+    '''
+    Packs a set of figures that share most of their layout into a single
+    dictionary that can be sent to the browser once, in a dcc.Store, and
+    turned back into any of the figures by a clientside callback.
+
+    The layout entries that are equal in every figure are stored once, and each
+    figure only keeps its traces and the layout entries that differ. A figure is
+    rebuilt as {'data': frame['data'], 'layout': {**layout, **frame['layout']}}.
+
+    input parameters:
+        figures: A dictionary mapping string keys to plotly figures
+
+    returns:
+        store: A dictionary with the shared 'layout' and the per key 'frames'
+    '''
+    figures = {key: json.loads(figure.to_json()) for (key, figure) in figures.items()}
+    layouts = [figure['layout'] for figure in figures.values()]
+
+    shared = {key: value for (key, value) in layouts[0].items()
+              if all(key in layout and layout[key] == value for layout in layouts)}
+    frames = {key: {'data': figure['data'],
+                    'layout': {k: v for (k, v) in figure['layout'].items() if k not in shared}}
+              for (key, figure) in figures.items()}
+
+    return {'layout': shared, 'frames': frames}
+
+
+def round_floats(input_, digits = 6):
+    '''
+    Returns a copy of a decoded JSON value with every float rounded to a number
+    of decimals. Plotly figures carry values such as 0.5900000000000001 that are
+    drawn the same way with far fewer digits.
+    '''
+    if isinstance(input_, float):
+        return round(input_, digits)
+    if isinstance(input_, dict):
+        return {key: round_floats(value, digits) for (key, value) in input_.items()}
+    if isinstance(input_, list):
+        return [round_floats(value, digits) for value in input_]
+    return input_
+
+
+def dumps(input_):
+    '''
+    Serializes a decoded JSON value as compact JSON bytes. It only encodes the
+    figures stored in a FigureCache, the responses are encoded by Dash.
+    '''
+    return json.dumps(input_, separators = (',', ':')).encode('utf-8')
+
+
+class ResponseCache:
+    '''
+    Thread safe LRU cache of callback response bodies, keyed by the callback
+    output and input values. See install_response_layer.
+    
+    input parameters:
+        maxsize: Maximum number of responses kept in the cache
+    '''
+
+    def __init__(self, maxsize = 1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._responses = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            body = self._responses.get(key)
+            if body is None:
+                self.misses += 1
+            else:
+                self._responses.move_to_end(key)
+                self.hits += 1
+            return body
+
+    def put(self, key, body):
+        with self._lock:
+            self._responses[key] = body
+            self._responses.move_to_end(key)
+            if len(self._responses) > self.maxsize:
+                self._responses.popitem(last = False)
+
+    def clear(self):
+        with self._lock:
+            self._responses.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'size': len(self._responses),
+                    'maxsize': self.maxsize}
+
+
+def callback_key(body, version = None):
+    '''
+    Returns the cache key of a Dash callback request: a digest of its output and
+    input/state values, and of the version of the data the callbacks run on.
+    changedPropIds is left out since the callbacks do not depend on which input
+    triggered them.
+    '''
+    key = {'version': version,
+           'output': body.get('output'),
+           'inputs': [(i.get('id'), i.get('property'), i.get('value')) for i in body.get('inputs', [])],
+           'state': [(i.get('id'), i.get('property'), i.get('value')) for i in body.get('state', [])]}
+    return hashlib.sha1(json.dumps(key, sort_keys = True, default = str).encode('utf-8')).hexdigest()
+
+
+def install_response_layer(server, cache, path_ = '/_dash-update-component', version = None):
+    '''
+    Installs a response cache around the Dash callbacks of a Flask server. The
+    response bodies are kept in cache under a key derived from the callback inputs,
+    so a repeated request skips the callback and serialization entirely. The keys
+    include the data version, so the cache never serves a response computed from
+    data that was since reloaded.
+    
+    The bodies are stored as Dash encoded them. The figures in them are rounded
+    once, when they are stored in a FigureCache, so a miss costs no extra decoding
+    or encoding. No HTTP caching headers are set: dash-renderer sends the callback
+    requests as POST requests, which browsers neither cache nor revalidate.
+    
+    input parameters:
+        server: The Flask server of the Dash app
+        cache: A ResponseCache
+        path_: Path of the Dash callback endpoint
+        version: Optional function with no arguments returning the current data version
+    '''
+    @server.before_request
+    def serve_cached_response():
+        if flask.request.method != 'POST' or flask.request.path != path_:
+            return None
+
+        key = callback_key(flask.request.get_json(silent = True) or {}, version() if version else None)
+        flask.g.callback_key = key
+        body = cache.get(key)
+        if body is None:
+            return None
+        flask.g.callback_cache_hit = True
+        return flask.Response(body, mimetype = 'application/json')
+
+    @server.after_request
+    def cache_response(response):
+        key = flask.g.get('callback_key')
+        if key is None or flask.g.get('callback_cache_hit') or response.status_code != 200:
+            return response
+
+        cache.put(key, response.get_data())
+        return response
@@ -0,0 +1,36 @@
+import gc
+import os
+import sys
+
+#Preload mode: dashboard.py is imported once in the gunicorn master, and its data
+#(honey_data, colony_data and the derived slider values) is loaded there by
+#dashboard.warm() before any worker is forked. The workers are forked from it and
+#share those pages copy-on-write, so adding workers does not add a copy of the
+#data per worker. The datasets are memory mapped from their columnar stores when
+#they exist, which keeps the column buffers in the shared page cache. Set GUNICORN_PRELOAD=0 to load the app in every worker instead.
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') != '0'
+
+
+def when_ready(server):
+    #Importing dashboard.py does not load the data, so load it here, in the master,
+    #instead of in each worker on its first request
+    dashboard = sys.modules.get('dashboard')
+    if preload_app and dashboard is not None:
+        dashboard.warm()
+
+
+def pre_fork(server, worker):
+    #Move everything loaded so far out of the garbage collector's reach, otherwise
+    #the first collection in each worker writes to every object header and
+    #unshares the pages holding them
+    if preload_app:
+        gc.freeze()
+
+
+def post_worker_init(worker):
+    #Reload the data when the worker gets DATA_RELOAD_SIGNAL (SIGUSR2 by default). It is
+    #installed here since the worker resets its signal handlers after it is forked. Send
+    #it to the workers, SIGUSR2 sent to the master starts a gunicorn binary upgrade
+    dashboard = sys.modules.get('dashboard')
+    if dashboard is not None:
+        dashboard.install_reload_signal()